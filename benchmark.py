@@ -0,0 +1,218 @@
+#   This file is part of gem5-stats-parser-visualizer
+#
+#   gem5-stats-parser-visualizer is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3.
+#
+#   gem5-stats-parser-visualizer is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with gem5-stats-parser-visualizer. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import glob
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import contextlib
+import io
+import matplotlib
+matplotlib.use('Agg')
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import gem5_parser as gp
+import split
+import instrument
+
+# Stage by stage benchmark of the parser
+#
+# Runs every stage of gem5_parser.py on a tree of sim directories (e.g. written
+# by gen_stats.py) and writes the wall time and memory use of each stage as JSON,
+# so that the results of different changes can be compared:
+#
+#   python gen_stats.py --sims 8 --rois 20 --stats 5000 -o /tmp/bench_tree
+#   python benchmark.py /tmp/bench_tree -o bench.json
+#
+# Stages:
+#   split       split.py: stats.txt -> stats.roi.NNNN files
+#   short_rois  generate_short_ROIs: ROI files -> .short files with the selected stats
+#   ingest      add_stats_in_tensor: .short files -> SimStats, and SimStats.to_dataframe
+#   filter      DataFrameIndex and filter_dataframe of every selected stat
+#   stream      stream_stats_in_tensor: stats.txt -> SimStats in a single pass
+#               (the ROI indexes are written by the first run)
+#   cache_cold  cached_stats_in_tensor, writing the stats caches
+#   cache_warm  cached_stats_in_tensor, with valid stats caches
+#   plot        get_plot_pages and save_plot_pages (without the plot cache)
+#
+# Every stage is timed --repeat times (the minimum is reported), then run once more
+# under tracemalloc for its peak Python/NumPy memory allocation.
+
+STAGES = ['split', 'short_rois', 'ingest', 'filter', 'stream', 'cache_cold', 'cache_warm', 'plot']
+
+# Stages that have to run before a stage (any of them)
+STAGE_DEPS = {'short_rois': ['split'], 'ingest': ['short_rois'], 'filter': ['ingest'],
+              'cache_warm': ['cache_cold'], 'plot': ['ingest', 'stream', 'cache_cold', 'cache_warm']}
+
+# Removes the files written by the stages (ROI files, caches, indexes, plots)
+def clean_tree(simdirs):
+    for dir in simdirs:
+        for pattern in ['*roi*', gp.stats_cache_prefix + '.*', '*' + split.index_suffix]:
+            for fname in glob.glob(os.path.join(dir, pattern)):
+                os.remove(fname)
+    if os.path.isfile(gp.graph_pdf_fname):
+        os.remove(gp.graph_pdf_fname)
+
+# State shared between the stages
+class BenchState:
+    def __init__(self, simdirs, selected_attrs, max_pages):
+        self.simdirs = simdirs
+        self.selected_attrs = selected_attrs
+        self.max_pages = max_pages
+        self.stats = None
+        self.df = None
+
+def stage_split(state):
+    for dir in state.simdirs:
+        split.process_directory(dir)
+
+def stage_short_rois(state):
+    gp.generate_short_ROIs(state.simdirs, state.selected_attrs)
+
+def stage_ingest(state):
+    state.stats = gp.add_stats_in_tensor(state.simdirs, state.selected_attrs)
+    state.df = state.stats.to_dataframe()
+
+def stage_filter(state):
+    index = gp.DataFrameIndex(state.df)
+    for attr in state.selected_attrs:
+        for ref in attr.stat_refs():
+            for sim_cnt in range(len(state.simdirs)):
+                gp.filter_dataframe(index, ref.name, sim_cnt=sim_cnt)
+
+def stage_stream(state):
+    state.stats = gp.stream_stats_in_tensor(state.simdirs, state.selected_attrs)
+
+def stage_cache_cold(state):
+    for dir in state.simdirs:
+        for fname in gp.get_cache_fnames(dir):
+            if os.path.isfile(fname):
+                os.remove(fname)
+    state.stats = gp.cached_stats_in_tensor(state.simdirs, state.selected_attrs)
+
+def stage_cache_warm(state):
+    state.stats = gp.cached_stats_in_tensor(state.simdirs, state.selected_attrs)
+
+def stage_plot(state):
+    pages = gp.get_plot_pages(state.selected_attrs, state.stats)
+    if state.max_pages:
+        pages = pages[:state.max_pages]
+    gp.save_plot_pages(pages, gp.graph_pdf_fname)
+    import matplotlib.pyplot as plt
+    plt.close('all')
+
+STAGE_FUNCS = {'split': stage_split, 'short_rois': stage_short_rois, 'ingest': stage_ingest,
+               'filter': stage_filter, 'stream': stage_stream, 'cache_cold': stage_cache_cold,
+               'cache_warm': stage_cache_warm, 'plot': stage_plot}
+
+# Runs one stage, returns its wall time in seconds
+# The stage output (debug prints) is discarded
+def run_stage(func, state):
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        func(state)
+        return time.perf_counter() - start
+
+# Runs one stage under tracemalloc, returns its peak allocation in bytes
+def trace_stage(func, state):
+    tracemalloc.start()
+    try:
+        run_stage(func, state)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+# Size of the benchmarked tree
+def tree_info(simdirs):
+    nbytes = 0
+    nlines = 0
+    for dir in simdirs:
+        stats_file = gp.get_stats_file(dir)
+        nbytes += os.path.getsize(stats_file)
+        with open(stats_file, 'rb') as f:
+            nlines += sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 20), b''))
+    return {'sims': len(simdirs), 'stats_bytes': nbytes, 'stats_lines': nlines}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stage by stage benchmark of the gem5 stats parser')
+    parser.add_argument('tree', help='directory with the sim directories (e.g. written by gen_stats.py)')
+    parser.add_argument('-o', '--output', default='bench.json',
+                        help='JSON file with the results (default: %(default)s)')
+    parser.add_argument('--input', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                        'input', 'input.csv'),
+                        help='input.csv with the selected stats (default: %(default)s)')
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help='comma separated stages to run (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of timed runs of each stage (default: %(default)s)')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='do not run the stages under tracemalloc')
+    parser.add_argument('--max-pages', type=int, default=50,
+                        help='number of plot pages rendered by the plot stage, 0 for all (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='gem5_parser jobs (default: %(default)s)')
+    args = parser.parse_args()
+
+    stages = args.stages.split(',')
+    for k, stage in enumerate(stages):
+        if stage not in STAGE_FUNCS:
+            print('ERROR: Unknown stage %s, stages are: %s' % (stage, ', '.join(STAGES)))
+            sys.exit()
+        deps = STAGE_DEPS.get(stage, [])
+        if deps and not any(dep in stages[:k] for dep in deps):
+            print('ERROR: Stage %s needs one of these stages to run first: %s' % (stage, ', '.join(deps)))
+            sys.exit()
+
+    input_fname = os.path.abspath(args.input)
+    output_fname = os.path.abspath(args.output)
+    os.chdir(args.tree)
+
+    gp.jobs = args.jobs
+    gp.Debug = False
+    simdirs = gp.get_dirs_current_path(os.getcwd(), 'sim')
+    gp.labels = simdirs
+    selected_attrs = gp.get_attr_from_csv(input_fname)
+
+    clean_tree(simdirs)
+    state = BenchState(simdirs, selected_attrs, args.max_pages)
+
+    results = {'tree': tree_info(simdirs),
+               'config': {'input': input_fname, 'jobs': args.jobs, 'repeat': args.repeat,
+                          'max_pages': args.max_pages},
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'stages': {}}
+
+    for stage in stages:
+        func = STAGE_FUNCS[stage]
+        times = [run_stage(func, state) for _ in range(args.repeat)]
+        res = {'seconds': min(times), 'runs': times}
+        if not args.no_memory:
+            res['peak_alloc_bytes'] = trace_stage(func, state)
+        # Peak RSS of the benchmark process so far (it never decreases between stages)
+        res['peak_rss_bytes'] = instrument.peak_rss_bytes()
+        results['stages'][stage] = res
+        print('%-12s %8.3f s%s' % (stage, res['seconds'],
+              '' if args.no_memory else '  %10.1f MB' % (res['peak_alloc_bytes'] / 1e6)))
+
+    clean_tree(simdirs)
+
+    with open(output_fname, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results written to %s' % output_fname)
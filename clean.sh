@@ -1,2 +1,7 @@
 rm sim_*/*roi*
+rm sim_*/stats.cache.*
+rm sim_*/stats.txt.idx
 rm graphs_out.pdf
+rm -r .plot_cache
+rm compare_summary.csv
+rm -r .spill
@@ -0,0 +1,180 @@
+#   This file is part of gem5-stats-parser-visualizer
+#
+#   gem5-stats-parser-visualizer is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3.
+#
+#   gem5-stats-parser-visualizer is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with gem5-stats-parser-visualizer. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import csv
+import glob
+import warnings
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import gem5_parser as gp
+from stat_expr import divide
+
+# Differences of all the stats between two groups of sims
+#
+# Finds the stats that moved between two groups of sims (e.g. before and after
+# a config change), without listing them in input.csv:
+#
+#   python diff_stats.py sim_0001 sim_0002
+#   python diff_stats.py 'base_*' 'prefetch_*' --top 50 -o diff.csv
+#
+# All the stats of all the sims are read from the stats caches (see gem5_parser.py),
+# so stats.txt is parsed (with the ROI splitting and parse_stat of gem5_parser.py)
+# only if its cache is missing or stale. ROIs are selected as in the plots
+# (ignore_last_roi, --rois).
+#
+# Each value column of each stat (the value columns of value / percent /
+# cumulative percent triplets) is compared in each ROI, with:
+# - a, b     : mean of the values of the sims of each group
+# - delta    : b - a
+# - rel_delta: (b - a) / |a|, nan if a is 0
+# - t        : Welch t statistic of the two groups, if both groups have at least 2 sims
+# Stats found in only one group are compared with nan values.
+# The differences of all the stats and ROIs are computed at once on [sim, stat column, roi] arrays.
+
+SORT_KEYS = ['rel_delta', 'delta', 't']
+
+diff_columns = ['stat', 'roi', 'a', 'b', 'delta', 'rel_delta', 't']
+
+# Returns the sim directories of a comma separated list of directories or glob patterns
+def expand_group(arg):
+    simdirs = []
+    for pattern in arg.split(','):
+        matched = sorted(dir for dir in glob.glob(pattern) if os.path.isdir(dir))
+        if not matched:
+            print('ERROR: No sim directory matching %s' % pattern)
+            sys.exit()
+        simdirs.extend(dir for dir in matched if dir not in simdirs)
+    return simdirs
+
+# Name of a value column of a stat, e.g. name[2] for the third value of a vector stat
+def column_name(name, value_idx, nvalues):
+    return name if nvalues == 1 else '%s[%d]' % (name, value_idx)
+
+# Reads the stats caches of the sim directories
+# Returns the names of the stat value columns and a [sim, stat column, roi] array
+def load_stat_columns(simdirs):
+    # Missing or stale caches are written first (in parallel with jobs > 1)
+    gp.map_simdirs(gp.update_stats_cache, simdirs)
+    caches = [gp.load_stats_cache(dir) for dir in simdirs]
+    roi_numbers = gp.select_rois(list(range(min(cached.number_of_rois for _, cached in caches))))
+
+    # Value columns of all the stats, in order of first appearance
+    column_index = {}
+    for meta, _ in caches:
+        for name, ncol, stride in zip(meta['stat_names'], meta['ncols'], meta['strides']):
+            nvalues = -(-ncol // stride)
+            for k in range(nvalues):
+                column_index.setdefault((name, k * stride), column_name(name, k, nvalues))
+
+    positions = {key: pos for pos, key in enumerate(column_index)}
+    values = np.full((len(caches), len(column_index), len(roi_numbers)), np.nan)
+    for sim_cnt, (meta, cached) in enumerate(caches):
+        stat_idx = []
+        cols = []
+        pos = []
+        for idx, (name, ncol, stride) in enumerate(zip(meta['stat_names'], meta['ncols'], meta['strides'])):
+            for col in range(0, ncol, stride):
+                stat_idx.append(idx)
+                cols.append(col)
+                pos.append(positions[(name, col)])
+        if pos:
+            # [stat column, roi] values, read from the memory mapped cache
+            values[sim_cnt][pos] = cached.columns(stat_idx, cols, roi_numbers)
+
+    return list(column_index.values()), values, roi_numbers
+
+# Differences of the [stat column, roi] means of two groups
+# a_values and b_values are [sim, stat column, roi] arrays
+# Returns a dict of [stat column, roi] arrays: a, b, delta, rel_delta and t
+def diff_groups(a_values, b_values):
+    with warnings.catch_warnings():
+        # Stat columns without values (in all the sims of a group) give nan
+        warnings.simplefilter('ignore', RuntimeWarning)
+        a = np.nanmean(a_values, axis=0)
+        b = np.nanmean(b_values, axis=0)
+        delta = b - a
+        ret = {'a': a, 'b': b, 'delta': delta, 'rel_delta': divide(delta, np.abs(a))}
+
+        na = np.sum(~np.isnan(a_values), axis=0)
+        nb = np.sum(~np.isnan(b_values), axis=0)
+        se = np.sqrt(np.nanvar(a_values, axis=0, ddof=1) / na + np.nanvar(b_values, axis=0, ddof=1) / nb)
+        ret['t'] = np.where((na > 1) & (nb > 1), divide(delta, se), np.nan)
+    return ret
+
+# Returns the (stat column, roi) positions of the top movers, sorted by |sort_key|
+# Values smaller than min_value in both groups are ignored (e.g. counters of unused components)
+def top_movers(diff, sort_key='rel_delta', top=20, min_value=0.0):
+    score = np.abs(diff[sort_key])
+    with np.errstate(invalid='ignore'):
+        small = np.fmax(np.abs(diff['a']), np.abs(diff['b'])) < min_value
+    score = np.where(np.isnan(score) | small | (diff['delta'] == 0), -1, score).ravel()
+    count = min(top, int(np.sum(score >= 0))) if top else int(np.sum(score >= 0))
+    if count == 0:
+        return []
+    order = np.argpartition(-score, count - 1)[:count]
+    order = order[np.argsort(-score[order], kind='stable')]
+    return [tuple(pos) for pos in np.array(np.unravel_index(order, diff['a'].shape)).T]
+
+def diff_rows(column_names, roi_numbers, diff, movers):
+    return [[column_names[col], roi_numbers[roi]] + [diff[key][col, roi] for key in diff_columns[2:]]
+            for col, roi in movers]
+
+def print_rows(rows):
+    width = max([len(row[0]) for row in rows] + [len('stat')])
+    print('%-*s %4s %14s %14s %14s %10s %8s' % ((width,) + tuple(diff_columns)))
+    for row in rows:
+        print('%-*s %4d %14.6g %14.6g %14.6g %9.2f%% %8.2f' % (width, row[0], row[1], row[2], row[3],
+                                                               row[4], row[5] * 100, row[6]))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find the stats that differ most between two groups of sims')
+    parser.add_argument('a', help='first group: comma separated sim directories or glob patterns, e.g. sim_0001')
+    parser.add_argument('b', help='second group, e.g. sim_0002')
+    parser.add_argument('--top', type=int, default=20,
+                        help='number of stats (and ROIs) shown, 0 for all (default: %(default)s)')
+    parser.add_argument('--sort', choices=SORT_KEYS, default='rel_delta',
+                        help='stats are sorted by the absolute value of this column (default: %(default)s)')
+    parser.add_argument('--min-value', type=float, default=0.0,
+                        help='ignore stats whose mean is smaller than this value in both groups (default: %(default)s)')
+    parser.add_argument('--rois', type=gp.parse_roi_slice, default=gp.roi_slice, metavar='START:STOP',
+                        help='slice of the ROIs to compare, applied after ignore_last_roi, e.g. --rois=-3: for the last 3 ROIs '
+                             '(negative starts need the = form)')
+    parser.add_argument('-j', '--jobs', type=int, default=gp.jobs,
+                        help='number of processes used to parse the sims without a valid stats cache (default: %(default)s)')
+    parser.add_argument('-o', '--output', help='also write the top stats in a csv file')
+    args = parser.parse_args()
+
+    gp.Debug = False
+    gp.jobs = args.jobs
+    gp.roi_slice = args.rois
+    a_dirs = expand_group(args.a)
+    b_dirs = expand_group(args.b)
+
+    column_names, values, roi_numbers = load_stat_columns(a_dirs + b_dirs)
+    diff = diff_groups(values[:len(a_dirs)], values[len(a_dirs):])
+    rows = diff_rows(column_names, roi_numbers, diff, top_movers(diff, args.sort, args.top, args.min_value))
+
+    print('%s (%d sims) vs %s (%d sims): %d stat columns, %d ROIs'
+          % (args.a, len(a_dirs), args.b, len(b_dirs), len(column_names), len(roi_numbers)))
+    print_rows(rows)
+
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(diff_columns)
+            writer.writerows(rows)
@@ -0,0 +1,223 @@
+#   This file is part of gem5-stats-parser-visualizer
+#
+#   gem5-stats-parser-visualizer is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3.
+#
+#   gem5-stats-parser-visualizer is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with gem5-stats-parser-visualizer. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import gem5_parser as gp
+import instrument
+
+# Columnar export of the parsed stats (needs the pyarrow package)
+#
+# All the stats of all the ROIs of each sim are written in a Parquet dataset,
+# partitioned by sim, so that a few stats can be read back without parsing
+# the stats.txt files again:
+#
+#   python export.py write -o sweep.parquet
+#   python export.py query sweep.parquet system.cpu.ipc simSeconds --rois 0:4
+#
+# Dataset layout:
+# - catalog.json              : sims (number of ROIs of each sim) and stats
+#                               (number of columns and stride of each stat)
+# - sim=sim_0001/stats.parquet: one row per value, with columns
+#                               stat (string), roi (int32), col (int16), value (float64)
+# Rows are sorted by stat and ROI and written in row groups of row_group_size rows.
+# A query opens only the partitions of the selected sims, skips the row groups
+# that it does not need (using the min/max statistics of the stat and roi
+# columns of each row group), and decodes only the requested columns.
+# The values are read from the stats cache of each sim (see gem5_parser.py),
+# so stats.txt is parsed only if its cache is missing or stale.
+
+catalog_fname = 'catalog.json'
+partition_fname = 'stats.parquet'
+row_group_size = 1 << 16
+EXPORT_VERSION = 1
+
+query_columns = ['sim', 'stat', 'roi', 'col', 'value']
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.dataset
+    except ImportError:
+        print('ERROR: The pyarrow package is needed to write and query Parquet datasets')
+        sys.exit()
+    return pyarrow
+
+# Schema of the tables returned by query_dataset
+def query_schema(pa):
+    return pa.schema([('sim', pa.string()), ('stat', pa.string()), ('roi', pa.int32()),
+                      ('col', pa.int16()), ('value', pa.float64())])
+
+def partition_dir(out_dir, sim):
+    return os.path.join(out_dir, 'sim=%s' % sim)
+
+# Writes the partition of one sim directory
+# Returns the catalog entries of the sim: number of ROIs, stat names, number of columns and strides
+def export_sim(dir, out_dir):
+    pa = import_pyarrow()
+    sim = os.path.basename(os.path.normpath(dir))
+
+    with instrument.stage('export', dir=dir):
+        meta, cached = gp.load_stats_cache(dir)
+        names = meta['stat_names']
+        nroi = cached.number_of_rois
+
+        # Rows sorted by stat name, then ROI, then column:
+        # the [roi, column] values of each stat, in the order of the names
+        order = np.argsort(np.array(names, dtype=object), kind='stable')
+        sizes = cached.ncols[order] * nroi
+        starts = np.cumsum(sizes) - sizes
+        stat_pos = np.repeat(np.arange(len(order)), sizes)
+        block_pos = np.arange(int(np.sum(sizes))) - np.repeat(starts, sizes)
+        ncol = cached.ncols[order][stat_pos]
+        values = np.asarray(cached.values)[np.repeat(cached.offsets[order], sizes) + block_pos]
+        instrument.add(bytes_read=values.nbytes)
+
+        table = pa.table({'stat': pa.array([names[k] for k in order]).take(pa.array(stat_pos)),
+                          'roi': pa.array((block_pos // ncol).astype(np.int32)),
+                          'col': pa.array((block_pos % ncol).astype(np.int16)),
+                          'value': pa.array(values)})
+
+        out_fname = os.path.join(partition_dir(out_dir, sim), partition_fname)
+        os.makedirs(os.path.dirname(out_fname), exist_ok=True)
+        tmp_fname = out_fname + '.tmp'
+        pa.parquet.write_table(table, tmp_fname, row_group_size=row_group_size,
+                               compression='zstd', write_statistics=True)
+        os.replace(tmp_fname, out_fname)
+
+    return sim, nroi, names, meta['ncols'], meta['strides']
+
+# Writes the dataset of the given sim directories in out_dir
+# Partitions of sims that are no longer in simdirs are removed
+def write_dataset(simdirs, out_dir):
+    import_pyarrow()
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Missing or stale stats caches are written first (in parallel with jobs > 1)
+    results = gp.map_simdirs(export_sim, simdirs, out_dir)
+
+    catalog = {'version': EXPORT_VERSION, 'sims': {}, 'stats': {}}
+    for sim, nroi, names, ncols, strides in results:
+        catalog['sims'][sim] = nroi
+        for name, ncol, stride in zip(names, ncols, strides):
+            old = catalog['stats'].get(name, [0, 1])
+            catalog['stats'][name] = [max(old[0], ncol), max(old[1], stride)]
+
+    for fname in os.listdir(out_dir):
+        if fname.startswith('sim=') and fname[len('sim='):] not in catalog['sims']:
+            shutil.rmtree(os.path.join(out_dir, fname))
+
+    gp.write_cache_meta(os.path.join(out_dir, catalog_fname), catalog)
+    return catalog
+
+def read_catalog(dataset_dir):
+    fname = os.path.join(dataset_dir, catalog_fname)
+    if not os.path.isfile(fname):
+        print('ERROR: %s is not an exported dataset (no %s)' % (dataset_dir, catalog_fname))
+        sys.exit()
+    with open(fname) as f:
+        catalog = json.load(f)
+    assert catalog.get('version') == EXPORT_VERSION, \
+        '%s was written by another version of export.py, write it again' % dataset_dir
+    return catalog
+
+# Reads the values of the stats matching patterns (see gem5_parser.find_stat_names),
+# optionally only of the ROIs of roi_slice and of the given sims
+# Returns a pyarrow Table with query_columns columns, sorted by sim, stat, ROI and column
+# (an empty table if no stat or no sim matches)
+def query_dataset(dataset_dir, patterns, roi_slice=None, sims=None, match_mode='exact'):
+    pa = import_pyarrow()
+    ds = pa.dataset
+    catalog = read_catalog(dataset_dir)
+
+    names = []
+    for pattern in patterns:
+        matched = gp.find_stat_names(catalog['stats'], pattern, match_mode)
+        if not matched:
+            print('WARNING: No stat matching %s in %s' % (pattern, dataset_dir))
+        names.extend(name for name in matched if name not in names)
+
+    if sims is None:
+        sims = list(catalog['sims'])
+    else:
+        for sim in sims:
+            if sim not in catalog['sims']:
+                print('WARNING: No sim %s in %s' % (sim, dataset_dir))
+        sims = [sim for sim in sims if sim in catalog['sims']]
+    if not names or not sims:
+        return query_schema(pa).empty_table()
+
+    # Only the partitions of the selected sims are opened
+    dataset = ds.dataset([os.path.join(partition_dir(dataset_dir, sim), partition_fname) for sim in sims],
+                         format='parquet', partition_base_dir=dataset_dir,
+                         partitioning=ds.partitioning(pa.schema([('sim', pa.string())]), flavor='hive'))
+    flt = ds.field('stat').isin(names)
+    # ROI slices are resolved against the largest number of ROIs,
+    # e.g. -1: is the last ROI of the longest sim
+    if roi_slice is not None:
+        rois = range(max(catalog['sims'].values(), default=0))[roi_slice]
+        if rois.step == 1:
+            flt &= (ds.field('roi') >= rois.start) & (ds.field('roi') < rois.stop)
+        else:
+            flt &= ds.field('roi').isin(list(rois))
+
+    table = dataset.to_table(columns=query_columns, filter=flt)
+    return table.sort_by([(col, 'ascending') for col in query_columns[:4]])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the parsed gem5 stats in a Parquet dataset, and query it')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    write_parser = commands.add_parser('write', help='write all the stats of the sims of the current directory')
+    write_parser.add_argument('-o', '--output', required=True, help='dataset directory')
+    write_parser.add_argument('-j', '--jobs', type=int, default=gp.jobs,
+                              help='number of processes used to export the sim directories (default: %(default)s)')
+
+    query_parser = commands.add_parser('query', help='read some stats of a dataset')
+    query_parser.add_argument('dataset', help='dataset directory')
+    query_parser.add_argument('stats', nargs='+', help='stat names (or patterns with --match)')
+    query_parser.add_argument('--rois', type=gp.parse_roi_slice, metavar='START:STOP',
+                              help='slice of the ROIs, e.g. --rois=-3: for the last 3 ROIs (negative starts need the = form, '
+                                   'default: all the ROIs)')
+    query_parser.add_argument('--sims', help='comma separated sims (default: all the sims)')
+    query_parser.add_argument('--match', choices=['exact', 'substring', 'glob'], default='exact',
+                              help='how the stat names are matched (default: %(default)s)')
+    query_parser.add_argument('-o', '--output',
+                              help='write the values in a .csv or .parquet file (default: csv on stdout)')
+    args = parser.parse_args()
+
+    if args.command == 'write':
+        gp.jobs = args.jobs
+        gp.Debug = False
+        simdirs = gp.get_simdirs(os.getcwd())
+        catalog = write_dataset(simdirs, args.output)
+        print('%d sims, %d stats written to %s' % (len(catalog['sims']), len(catalog['stats']), args.output))
+    else:
+        pa = import_pyarrow()
+        import pyarrow.csv
+        sims = args.sims.split(',') if args.sims else None
+        table = query_dataset(args.dataset, args.stats, args.rois, sims, args.match)
+        if args.output is None:
+            pyarrow.csv.write_csv(table, sys.stdout.buffer)
+        elif args.output.endswith('.parquet'):
+            pa.parquet.write_table(table, args.output)
+        else:
+            pyarrow.csv.write_csv(table, args.output)
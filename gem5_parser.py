@@ -14,15 +14,34 @@
 
 import re
 import os
+import io
 import csv
 import sys
+import shutil
+import copy
+import contextlib
 import numpy as np
 from os import listdir
 from os.path import isfile, join
-import matplotlib.pyplot as plt
-import pandas as pd
-from matplotlib.backends.backend_pdf import PdfPages
 import traceback
+import tempfile
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import hashlib
+import fnmatch
+import bisect
+import json
+import time
+import warnings
+from array import array
+import instrument
+import split
+from stat_expr import parse_expr, split_outer_range, StatRef, ExprError, \
+    is_pattern, pattern_prefix, pattern_regex, resolve_patterns, divide
+from split import iter_rois, write_file, load_roi_index, iter_indexed_rois, find_stats_file, is_compressed, \
+    RoiTail
+from native_stats import find_native_stats_file, is_native, read_native_stats
 #import glob
 
 # Format of Stats we are interested in
@@ -30,14 +49,16 @@ import traceback
 # An example can be:
 # system.ruby.network.average_packet_vqueue_latency ,value,Queue Latency,500
 #
-# Also complex stats can be provided like the following:
+# Also complex stats (arithmetic expressions of stats, see stat_expr.py) can be provided like the following:
 # system.ruby.network.router_flit_queueing_latency / system.ruby.network.router_flits_received ,value,Queue Latency,500
+# sum(system.mem_ctrls[0-7].dram.readBursts) / simSeconds ,value,Read Bursts per second,1
 #
 # The input.csv should have 4 columns:
-# 1) statname (or stat1 / stat2), that we want to chart.
-#    If stat1/stat2 is defined then this stat is considered a complex stat
+# 1) statname (or an expression of stats), that we want to chart.
+#    If an expression is defined then this stat is considered a complex stat
 # 2) Second column (stat_type), should contain one of: value, percent, cumm_percent
-#    (Currently only value is supported)
+#    percent and cumm_percent can only be used with stats that have percent columns
+#    (distribution buckets, Ruby vectors and histograms)
 # 3) Third column: Title of the chart (description)
 # 4) Fourth column (calculation): An int value X, The chart values are divided by X
 #    This is basically used for graph units conversion, e.g:
@@ -46,15 +67,10 @@ import traceback
 #
 class Stat:
     def __init__(self,name,type,description,calculation):
-        if '/' in name:
-            spl = name.split('/')
-            self.name = spl[0]
-            self.name2 = spl[1].lstrip()
-            self.isComplex = True
-        else:
-            self.name = name
-            self.name2 = ''
-            self.isComplex = False
+        self.name = name.strip()
+        # Expression tree of the stat, see stat_expr.py
+        self.expr = parse_expr(name)
+        self.isComplex = not isinstance(self.expr, StatRef)
         self.type = type
         self.description = description
 
@@ -63,10 +79,13 @@ class Stat:
         else:
             self.calculation = float(calculation)
 
+    # The gem5 stats used by this Stat (StatRef nodes)
+    def stat_refs(self):
+        return self.expr.stat_refs()
+
     def print(self,idx):
-        printd('Stat[%d] [isComplex=%s]: %s / %s -- %s  -- %s'
-            %(idx, self.isComplex, self.name,
-              self.name2, self.type, self.description))
+        printd('Stat[%d] [isComplex=%s]: %s -- %s  -- %s'
+            %(idx, self.isComplex, self.expr, self.type, self.description))
 
 
 # List directories found in the current directory,
@@ -78,14 +97,63 @@ def get_dirs_current_path(path, filter_str):
 
 # Returns roi files list for a given directory
 # Skipping .short ROI files
-def get_rois_list(path):
+def get_roi_files_list(path):
     return [f for f in sorted(listdir(path)) if ('roi' in f and 'short' not in f)]
 
+# Returns the stats file of a given directory
+# (stats.txt, or a compressed stats.txt.gz / .bz2 / .zst, or stats.h5 / stats.json,
+# see use_native_stats)
+def get_stats_file(path):
+    stats_file = find_stats_file(path)
+    if stats_file is None or use_native_stats:
+        stats_file = find_native_stats_file(path) or stats_file
+    if stats_file is None:
+        raise FileNotFoundError('No stats.txt found in %s' % path)
+    return stats_file
+
+# Returns the [start, end) byte offsets of the ROIs of the stats.txt
+# of a given directory, using its ROI index (stats.txt.idx)
+def get_rois_list(path):
+    return load_roi_index(get_stats_file(path))
+
+# Parses a START:STOP (or a single ROI number) command line argument to a slice
+def parse_roi_slice(arg):
+    if ':' not in arg:
+        k = int(arg)
+        return slice(k, (k + 1) or None)
+    start, stop = arg.split(':', 1)
+    return slice(int(start) if start else None, int(stop) if stop else None)
+
+# Applies ignore_last_roi and roi_slice to a list of ROIs
+# A running sim (in follow mode) has not written its shutdown ROI yet,
+# so its last ROI is kept
+def select_rois(rois, running=False):
+    # [:-1] to ignore last ROI
+    if ignore_last_roi and not running:
+        rois = rois[:-1]
+    if roi_slice is not None:
+        rois = rois[roi_slice]
+    return rois
+
 # Returns roi files list for a given directory, with .short extension
 def get_short_rois_list(path):
     return [f for f in sorted(listdir(path)) if 'short' in f]
 
 
+# Expands the ranges of a stat name (or expression) which are not inside a function call
+# e.g: system.cpu[0-1].ipc -> system.cpu0.ipc, system.cpu1.ipc
+# while sum(system.cpu[0-1].ipc) is kept as a single stat
+def expand_outer_ranges(stat_name):
+    rng = split_outer_range(stat_name)
+    if rng is None:
+        return [stat_name]
+    before_text, start, end, after_text = rng
+    assert(start < end)
+    ret = []
+    for k in range(start, end + 1):
+        ret.extend(expand_outer_ranges(before_text + str(k) + after_text))
+    return ret
+
 # returns a list of Stat instances
 def get_attr_from_csv(input_fname):
 
@@ -96,7 +164,6 @@ def get_attr_from_csv(input_fname):
     graph_type_per_attr = []
     units_row = []
     stat_calculation = []
-    pattern = r'^(.*)\[(\d+)-(\d+)\](.*)$'
 
     with open(input_fname) as csv_file:
         csv_reader = csv.reader(csv_file, delimiter=',')
@@ -109,39 +176,16 @@ def get_attr_from_csv(input_fname):
             stat_name = row[0]
 
             # if stat name contains a range e.g: cpus[0-15], expand that range to several single stats
-            if '[' in stat_name:
-                match = re.search(pattern, stat_name)
-                if match:
-                    before_text = match.group(1)
-                    start = int(match.group(2))
-                    end = int(match.group(3))
-                    after_text = match.group(4)
-                    assert(start < end)
-
-                else:
-                    print('WARNING: No match found for range expression')
-                    assert(0)
-            else:
-                start = 0
-                end = 0
-
-            for counter in np.arange(0, end - start + 1):
-                if (start == end) and (start == 0):
-                    search_attributes.append(row[0])
-                else:
-                    newname = before_text+ str(start+counter) +after_text
-                    search_attributes.append(newname)
-                    #print('APPENDING: %s' % newname)
+            # (ranges inside sum(), mean(), min(), max() are expanded by the expression parser instead)
+            for newname in expand_outer_ranges(stat_name):
+                search_attributes.append(newname)
 
                 # Save user's input regarding which stats column should be used
                 # for graphs
                 graph_type = row[1].strip()
 
                 # Any of those 3 columns can be used in the graph
-                # TODO: Currently only value is supported
-                assert( graph_type == 'percent' or
-                    graph_type == 'value' or
-                    graph_type == 'cumm_percent')
+                assert(graph_type in COLUMN_TYPES)
 
                 graph_type_per_attr.append(graph_type)
 
@@ -152,19 +196,66 @@ def get_attr_from_csv(input_fname):
                 stat_calculation.append(row[3].strip())
 
     #Check input.csv for duplicates
-    for i in np.arange(0, len(search_attributes), 1):
-        for j in np.arange(0, len(search_attributes), 1):
-            if i == j:
-                continue
-            else:
-                if search_attributes[i] == search_attributes[j]:
-                    print('ERROR: Your input file contains duplicate search attributes: %s'
-                          % search_attributes[i])
-                    sys.exit()
+    seen = set()
+    # (the same stat can be plotted once per stat_type)
+    for attr, graph_type in zip(search_attributes, graph_type_per_attr):
+        if (attr, graph_type) in seen:
+            print('ERROR: Your input file contains duplicate search attributes: %s'
+                  % attr)
+            sys.exit()
+        seen.add((attr, graph_type))
 
     retlist = []
     for i in np.arange(0, len(search_attributes)):
-        retlist.append(Stat(search_attributes[i], graph_type_per_attr[i], units_row[i], stat_calculation[i]))
+        try:
+            retlist.append(Stat(search_attributes[i], graph_type_per_attr[i], units_row[i], stat_calculation[i]))
+        except ExprError as e:
+            print('ERROR: %s' % e)
+            sys.exit()
+
+    return retlist
+
+# Expands the stat name patterns of the selected attrs, using a StatCatalog
+# of the parsed stat names:
+# - an input.csv stat that is a single pattern, e.g. system.cpu*.l2.cache.m_demand_*,
+#   is expanded to one Stat per matching stat name
+# - patterns inside function calls, e.g. sum(system.cpu[*].ipc), are expanded to
+#   the function arguments
+# Stats that are already selected are not added again.
+# A pattern that matches no stat is an error, or, if skip_unmatched is set (follow mode,
+# where the stats can appear in later ROIs), its Stat is skipped.
+# The selected attrs are not changed, so they can be expanded again.
+# Returns the new list of Stat instances
+def expand_stat_patterns(selected_attrs, catalog, skip_unmatched=False):
+    seen = set((attr.name, attr.type) for attr in selected_attrs if not is_pattern(attr.name))
+    retlist = []
+    for attr in selected_attrs:
+        unmatched = [ref.name for ref in attr.stat_refs() if is_pattern(ref.name) and not catalog.match(ref.name)]
+        if unmatched:
+            if skip_unmatched:
+                printd('Skipping %s (no stats match %s yet)' % (attr.name, unmatched[0]))
+                continue
+            print(f'ERROR: No stats match {unmatched[0]}')
+            sys.exit()
+
+        if isinstance(attr.expr, StatRef) and is_pattern(attr.name):
+            for name in catalog.match(attr.name):
+                if (name, attr.type) in seen:
+                    printd('Skipping %s (already selected)' % name)
+                    continue
+                seen.add((name, attr.type))
+                retlist.append(Stat(name, attr.type, attr.description, attr.calculation))
+            continue
+
+        if any(is_pattern(ref.name) for ref in attr.stat_refs()):
+            resolved = copy.copy(attr)
+            try:
+                resolved.expr = resolve_patterns(attr.expr, catalog.match)
+            except ExprError as e:
+                print(f'ERROR: {e}')
+                sys.exit()
+            attr = resolved
+        retlist.append(attr)
 
     return retlist
 
@@ -173,113 +264,951 @@ def printd(s):
     if Debug:
         print(s)
 
+# Character trie of stat name prefixes
+# Used when stat_match_mode is 'prefix', so that finding all the
+# selected prefixes of a stat name costs O(len(stat_name)),
+# regardless of the number of selected stats.
+class PrefixTrie:
+    def __init__(self, prefixes):
+        self.root = {}
+        for prefix in prefixes:
+            node = self.root
+            for ch in prefix:
+                node = node.setdefault(ch, {})
+            # None key marks the end of a prefix
+            node[None] = prefix
+
+    # Returns the list of inserted prefixes that stat_name starts with
+    def match(self, stat_name):
+        ret = []
+        node = self.root
+        for ch in stat_name:
+            node = node.get(ch)
+            if node is None:
+                break
+            if None in node:
+                ret.append(node[None])
+        return ret
+
+# Stat name patterns (e.g. system.cpu*.l2.cache.m_demand_*) selected in input.csv
+# The patterns are grouped by the text before their first wildcard, and a
+# PrefixTrie finds the groups that can match a stat name, so only a few
+# regexes are tried per stat name. Results are remembered per stat name,
+# since the same stat names appear in every ROI.
+class StatPatterns:
+    def __init__(self, patterns):
+        self.by_prefix = {}
+        for pattern in patterns:
+            self.by_prefix.setdefault(pattern_prefix(pattern), []).append((pattern, pattern_regex(pattern)))
+        self.trie = PrefixTrie(self.by_prefix.keys())
+        self.matched = {}
+
+    # Returns the patterns that match stat_name
+    def match(self, stat_name):
+        ret = self.matched.get(stat_name)
+        if ret is None:
+            prefixes = self.trie.match(stat_name)
+            if '' in self.by_prefix:
+                prefixes.append('')
+            ret = [pattern for prefix in prefixes
+                   for pattern, regex in self.by_prefix[prefix] if regex.fullmatch(stat_name)]
+            self.matched[stat_name] = ret
+        return ret
+
+# Sorted array of stat names, e.g. all the parsed stat names
+# Used to expand the stat name patterns of input.csv: the names starting with
+# the text before the first wildcard are found with a binary search,
+# and only these are matched against the pattern.
+class StatCatalog:
+    def __init__(self, stat_names):
+        self.names = sorted(set(stat_names))
+
+    # Returns the stat names matching a pattern, in natural order
+    # (e.g. cpu2 before cpu10)
+    def match(self, pattern):
+        prefix = pattern_prefix(pattern)
+        regex = pattern_regex(pattern)
+        ret = []
+        for k in range(bisect.bisect_left(self.names, prefix), len(self.names)):
+            name = self.names[k]
+            if not name.startswith(prefix):
+                break
+            if regex.fullmatch(name):
+                ret.append(name)
+        return sorted(ret, key=natural_sort_key)
+
+def natural_sort_key(name):
+    return [int(x) if x.isdigit() else x for x in re.split(r'(\d+)', name)]
+
+# Index of the stat names selected in input.csv
+# A stat line is selected by parsing its stat name once and looking it up
+# in a set of the selected names, so the cost per line does not depend on
+# the number of selected attrs.
+#
+# With match_mode 'prefix', a selected name also selects all stats
+# starting with it (e.g. 'system.cpu0.iq.rate' selects 'system.cpu0.iq.rate::total').
+# Names followed by spaces in input.csv are still matched exactly,
+# since the space marks the end of the stat name.
+#
+# Stat name patterns select all the matching stats (see StatPatterns),
+# they are not added as missing stats if nothing matches.
+class StatSelector:
+    def __init__(self, selected_attrs, match_mode='exact'):
+        assert(match_mode == 'exact' or match_mode == 'prefix')
+        self.names = set()
+        prefixes = set()
+        patterns = set()
+
+        for attr in selected_attrs:
+            for ref in attr.stat_refs():
+                if is_pattern(ref.name):
+                    patterns.add(ref.name)
+                elif match_mode == 'prefix' and not ref.exact:
+                    prefixes.add(ref.name)
+                else:
+                    self.names.add(ref.name)
+
+        # Exact names are also handled through the prefix set, if both exist
+        self.names -= prefixes
+        self.prefixes = prefixes
+        self.trie = PrefixTrie(prefixes) if prefixes else None
+        self.patterns = StatPatterns(patterns) if patterns else None
+
+    # Returns the selected names/prefixes/patterns that match stat_name
+    def match(self, stat_name):
+        ret = []
+        if stat_name in self.names:
+            ret.append(stat_name)
+        if self.trie is not None:
+            ret.extend(self.trie.match(stat_name))
+        if self.patterns is not None:
+            ret.extend(self.patterns.match(stat_name))
+        return ret
+
+    # All the selected names/prefixes (without the patterns)
+    def keys(self):
+        return self.names | self.prefixes
+
+# Selects from the lines of one ROI only the stats we are interested in
+# Missing stats are added with a nan value
+# Returns the kept stat lines, sorted
+def select_roi_stats(roi_lines, selector):
+    keep_stat_lines = []
+    found = set()
+
+    for ln in roi_lines:
+        tokens = ln.split(None, 1)
+        if not tokens:
+            continue
+        matched = selector.match(tokens[0])
+        if matched:
+            keep_stat_lines.append(ln)
+            found.update(matched)
+            #print('Keeping: %s' % ln[:-1])
+
+    # The following adds missing stats we are interested in
+    missing = selector.keys() - found
+    for name in missing:
+        keep_stat_lines.append('%s nan # Missing stat\n' % name)
+    instrument.add(stats_kept=len(keep_stat_lines) - len(missing), stats_missing=len(missing))
+    keep_stat_lines.sort()
+
+    return keep_stat_lines
+
+# Keeping a smaller roi stats file with only the stats we are interested in
+def write_short_roi(roifile, keep_stat_lines):
+    with open(roifile+'.short', 'w') as fl2:
+        for ln in keep_stat_lines:
+            fl2.write('%s'%ln)
+
+# Generate the .short ROI files of one sim directory
+# Returns the number of ROI files found
+def generate_short_sim_ROIs(dir, selector):
+    printd('--- Directory: %s ---'%dir)
+    roi_cnt = 0
+    with instrument.stage('short_rois', dir=dir):
+        for f in get_roi_files_list(dir):
+            roifile = dir+'/'+ f
+            printd('--- ROI file: %s --- '%roifile)
+            roi_cnt += 1
+            with open(roifile) as fl:
+                keep_stat_lines = select_roi_stats(fl, selector)
+            instrument.add(bytes_read=os.path.getsize(roifile))
+
+            write_short_roi(roifile, keep_stat_lines)
+
+    return roi_cnt
+
 # Generate smaller stats files
 # that contain only the stats we are interested in
 # These files will have .short extension
 def generate_short_ROIs(simdirs, selected_attrs):
 
-    number_of_rois = 0
+    selector = StatSelector(selected_attrs, stat_match_mode)
+    roi_counts = map_simdirs(generate_short_sim_ROIs, simdirs, selector)
 
-    for dir in simdirs:
-        printd('--- Directory: %s ---'%dir)
-        roi_cnt = 0
-        for f in get_rois_list(dir):
-            roifile = dir+'/'+ f
-            printd('--- ROI file: %s --- '%roifile)
-            roi_cnt += 1
-            fl = open(roifile)
-            keep_stat_lines = []
-
-            for ln in fl:
-                for attr in selected_attrs:
-                    if (attr.name in ln) or (attr.isComplex and attr.name2 in ln):
-                        if ' nan ' in ln:
-                            ln = ln.replace(' nan ', ' 0 ')
-                        keep_stat_lines.append(ln)
-                        #print('Keeping: %s' % ln[:-1])
-                        break
-
-            # The following adds missing stats we are interested in
-            for attr in selected_attrs:
-                nameFound = False
-                name2Found = False
-                for ln in keep_stat_lines:
-                    if (attr.name in ln):
-                        nameFound = True
-                    if (attr.isComplex and attr.name2 in ln):
-                        name2Found = True
-                if not nameFound:
-                    keep_stat_lines.append('%s 0 # Missing stat\n' % attr.name)
-                if (attr.isComplex and (not name2Found)):
-                    keep_stat_lines.append('%s 0 # Missing stat\n' % attr.name2)
-            keep_stat_lines.sort()
-
-            ## Keeping a smaller roi stats file with only the stats we are interested in
-            fl2 = open(roifile+'.short', 'w')
-            for ln in keep_stat_lines:
-                fl2.write('%s'%ln)
-
-        if( number_of_rois == 0):
-            number_of_rois = roi_cnt
-        else:
-            assert(number_of_rois == roi_cnt)
-
-    return number_of_rois
+    return check_number_of_rois(simdirs, roi_counts)
 
 # Parses stat name and values from a stat line
 # Returns a list where
 # First element is the stat_name
-# Second element is a list with the values of this stat
+# Second element is a list with the values of this stat (strings)
+# Third element is the column stride of the stat:
+# - 3 if the values are value / percent / cumulative percent triplets,
+#   e.g. distribution buckets (system.cpu.fetch.rateDist::0-1) and
+#   Ruby vectors and histograms (| value percent% cumulative% | ...)
+# - 1 otherwise, e.g. scalars, ::samples, ::mean, or 1 value per VNET
 def parse_stat(ln):
-    ret = ln.split('#')[0]
-    ret = ret.split(' ')
-    ret2 = [f for f in ret if (f!='' and f!='|' and '(' not in f)]
-    # Characters to remove
-    chars_to_remove = "|%"
-
-    # Removing the specified characters from each string in the list
-    values = [s.replace('|', '').replace('%', '') for s in ret2[1:]]
-    return [ret2[0], values]
-
-def add_stats_in_dataframe(simdirs, selected_attrs):
-
-    sim_cnt = 0
-    df = pd.DataFrame(columns = df_cols)
-
-    for dir in simdirs:
-        roi_cnt = 0
-        printd('--- Directory: %s ---'%dir)
-        short_roi_list = get_short_rois_list(dir)
-
-        # [:-1] to ignore last ROI
-        if ignore_last_roi:
-            short_roi_list = short_roi_list[:-1]
-
+    ret = ln.split('#', 1)[0]
+    stride = 3 if '%' in ret else 1
+    # Removing the '|' and '%' characters
+    if stride == 3 or '|' in ret:
+        ret = ret.replace('|', ' ').replace('%', ' ')
+    ret2 = ret.split()
+    values = [f for f in ret2[1:] if '(' not in f]
+    return [ret2[0], values, stride]
+
+# Converts a list of stat value strings to a float64 array
+# Values that are not numbers are masked (nan)
+def values_to_floats(values):
+    try:
+        return np.array(values, dtype=np.float64)
+    except ValueError:
+        ret = []
+        for x in values:
+            try:
+                ret.append(float(x))
+            except ValueError:
+                ret.append(np.nan)
+        return np.array(ret, dtype=np.float64)
+
+# Meaning of the columns in a value / percent / cumulative percent triplet
+# (the stat_type column of input.csv)
+COLUMN_TYPES = ['value', 'percent', 'cumm_percent']
+
+# Parsed stats of all the simulations, kept in a dense float64 array
+#
+# values[sim, roi, stat, column] holds the value of a stat, where:
+# - stat is the index of the stat name in stat_names (see stat_index)
+# - column is the index of the value in the stats.txt line,
+#   e.g. 1 value per VNET, or value / percent / cumulative percent
+# Missing stats, nan values and columns after the last column
+# of a stat (ncols[stat]) are masked with nan.
+# strides[stat] is 3 if the columns of a stat are value / percent / cumulative
+# percent triplets, otherwise 1 (see parse_stat).
+class SimStats:
+    def __init__(self, values, stat_names, ncols, strides=None):
+        self.values = values
+        self.stat_names = stat_names
+        self.stat_index = {name: idx for idx, name in enumerate(stat_names)}
+        self.ncols = ncols
+        if strides is None:
+            strides = np.ones(len(stat_names), dtype=int)
+        self.strides = strides
+        # Names of the sim directories (set by parse_stats), used as plot labels
+        self.sim_names = None
+
+    def number_of_sims(self):
+        return self.values.shape[0]
+
+    def number_of_rois(self):
+        return self.values.shape[1]
+
+    # Returns the [sim, roi, column] values of a stat, or None if the stat
+    # was not parsed
+    def get(self, stat_name):
+        idx = self.stat_index.get(stat_name.strip())
+        if idx is None:
+            return None
+        return self.values[:, :, idx, :self.ncols[idx]]
+
+    # Returns the [sim, roi, column] values of one column type (see COLUMN_TYPES)
+    # of a stat, or None if the stat was not parsed.
+    # For value / percent / cumulative percent triplets, every third column
+    # is selected, e.g. the 4 values of a stat with 12 columns.
+    # Raises ValueError if a percent column type is requested for a stat without percents.
+    def get_columns(self, stat_name, stat_type='value'):
+        idx = self.stat_index.get(stat_name.strip())
+        if idx is None:
+            return None
+        stride = self.strides[idx]
+        offset = COLUMN_TYPES.index(stat_type)
+        if offset >= stride:
+            raise ValueError('%s has no %s columns' % (stat_name.strip(), stat_type))
+        return self.values[:, :, idx, offset:self.ncols[idx]:stride]
+
+    # Returns the parsed stat names matching pattern, in parsing order
+    # match_mode is one of:
+    # - 'exact': the stat name itself (O(1) lookup in stat_index)
+    # - 'substring': stat names containing pattern (plain text, not a regex)
+    # - 'glob': stat names matching a shell-style pattern, e.g. system.cpu*.ipc
+    def find(self, pattern, match_mode='exact'):
+        return find_stat_names(self.stat_index, pattern, match_mode)
+
+    # True where a value is masked (missing stat or nan)
+    def mask(self):
+        return np.isnan(self.values)
+
+    # Returns a DataFrame with df_cols columns, one row per sim/roi/stat
+    def to_dataframe(self):
+        import pandas as pd
+        with instrument.stage('dataframe'):
+            nsim, nroi, nstat, _ = self.values.shape
+            sim, roi, stat = np.indices((nsim, nroi, nstat)).reshape(3, -1)
+            return pd.DataFrame({df_cols[0]: sim,
+                                 df_cols[1]: roi,
+                                 df_cols[2]: [self.stat_names[k] for k in stat],
+                                 df_cols[3]: [list(self.values[s, r, k, :self.ncols[k]])
+                                              for s, r, k in zip(sim, roi, stat)]},
+                                columns = df_cols)
+
+# Collects parsed stat rows and builds a SimStats instance once at the end
+# Values of all rows are appended in a single flat float buffer, so
+# ingest time is linear in the total number of rows and no per-row
+# Python objects are kept.
+class SimStatsBuilder:
+    def __init__(self):
+        self.sim_col = array('i')
+        self.roi_col = array('i')
+        self.stat_col = array('i')
+        self.len_col = array('i')
+        self.flat_values = array('d')
+        self.stat_index = {}
+        self.strides = []
+
+    # Parses the given stat lines of one ROI and appends them as rows
+    # The values of all the rows of the ROI are converted to floats at once
+    def add_roi_rows(self, sim_cnt, roi_cnt, stat_lines):
+        roi_values = []
+        for ln in stat_lines:
+            ret = parse_stat(ln)
+            stat_idx = self.stat_index.setdefault(ret[0], len(self.stat_index))
+            if stat_idx == len(self.strides):
+                self.strides.append(ret[2])
+            elif ret[2] > self.strides[stat_idx]:
+                self.strides[stat_idx] = ret[2]
+            self.sim_col.append(sim_cnt)
+            self.roi_col.append(roi_cnt)
+            self.stat_col.append(stat_idx)
+            self.len_col.append(len(ret[1]))
+            roi_values.extend(ret[1])
+        self.flat_values.frombytes(values_to_floats(roi_values).tobytes())
+
+    def build(self, number_of_sims, number_of_rois):
+        lens = np.frombuffer(self.len_col, dtype=np.int32) if self.len_col else np.zeros(0, dtype=np.int32)
+        nstat = len(self.stat_index)
+        ncols = np.zeros(nstat, dtype=int)
+        if nstat:
+            np.maximum.at(ncols, np.frombuffer(self.stat_col, dtype=np.int32), lens)
+        ncol_max = int(ncols.max()) if nstat else 0
+
+        values = np.full((number_of_sims, number_of_rois, nstat, ncol_max), np.nan)
+        if len(self.flat_values):
+            # Scatter the flat buffer: row r covers flat_values[start[r]:start[r]+lens[r]]
+            starts = np.cumsum(lens) - lens
+            col = np.arange(len(self.flat_values)) - np.repeat(starts, lens)
+            values[np.repeat(np.frombuffer(self.sim_col, dtype=np.int32), lens),
+                   np.repeat(np.frombuffer(self.roi_col, dtype=np.int32), lens),
+                   np.repeat(np.frombuffer(self.stat_col, dtype=np.int32), lens),
+                   col] = np.frombuffer(self.flat_values, dtype=np.float64)
+
+        stat_names = [None] * nstat
+        for name, idx in self.stat_index.items():
+            stat_names[idx] = name
+
+        return SimStats(values, stat_names, ncols, np.array(self.strides, dtype=int))
+
+    # Builds a RaggedStats instance of a single sim, without padding the stats
+    # to the widest stat
+    def build_ragged(self, number_of_rois):
+        lens = np.frombuffer(self.len_col, dtype=np.int32) if self.len_col else np.zeros(0, dtype=np.int32)
+        stat_col = np.frombuffer(self.stat_col, dtype=np.int32) if self.stat_col else np.zeros(0, dtype=np.int32)
+        nstat = len(self.stat_index)
+        ncols = np.zeros(nstat, dtype=np.int64)
+        if nstat:
+            np.maximum.at(ncols, stat_col, lens)
+
+        stat_names = [None] * nstat
+        for name, idx in self.stat_index.items():
+            stat_names[idx] = name
+        stats = RaggedStats(None, stat_names, ncols, self.strides, number_of_rois)
+
+        stats.values = np.full(int(np.sum(ncols)) * number_of_rois, np.nan)
+        if len(self.flat_values):
+            # Row r covers flat_values[start[r]:start[r]+lens[r]], and goes to the
+            # ROI roi_col[r] of its stat
+            starts = np.cumsum(lens) - lens
+            col = np.arange(len(self.flat_values)) - np.repeat(starts, lens)
+            row_pos = stats.offsets[stat_col] + np.frombuffer(self.roi_col, dtype=np.int32) * ncols[stat_col]
+            stats.values[np.repeat(row_pos, lens) + col] = np.frombuffer(self.flat_values, dtype=np.float64)
+
+        return stats
+
+# Configuration read by the worker processes
+# Workers started with spawn or forkserver (the default on macOS and Windows, and on
+# Linux from Python 3.14) import gem5_parser.py again, without the values set by main()
+# or by library callers, so these values are copied to each worker when it starts.
+worker_config_names = ['ignore_last_roi', 'roi_slice', 'keep_roi_files', 'use_roi_index', 'use_native_stats',
+                       'stat_match_mode', 'stats_cache_prefix', 'labels', 'max_heatmap_labels',
+                       'linestyles', 'markers', 'g_colors', 'Debug']
+
+def get_worker_config():
+    return {name: globals()[name] for name in worker_config_names}, split.get_config()
+
+def set_worker_config(config):
+    globals().update(config[0])
+    split.set_config(config[1])
+
+# Returns a pool of n worker processes, with the configuration of this process
+def worker_pool(n):
+    return ProcessPoolExecutor(max_workers=n, initializer=set_worker_config, initargs=(get_worker_config(),))
+
+# Runs func(dir, *args) for each sim directory and returns the results
+# in the order of simdirs.
+# With jobs > 1 the sim directories are processed in a pool of processes.
+def map_simdirs(func, simdirs, *args):
+    if jobs > 1 and len(simdirs) > 1:
+        with worker_pool(min(jobs, len(simdirs))) as executor:
+            # The instrumentation records of the worker processes are sent back with the results
+            if instrument.enabled:
+                return instrument.merge(executor.map(instrument.collect, repeat(func), simdirs,
+                                                     *[repeat(a) for a in args]))
+            return list(executor.map(func, simdirs, *[repeat(a) for a in args]))
+    return [func(dir, *args) for dir in simdirs]
+
+# make sure that all the simulations have the same number of ROIs
+# as the first simulation
+# Returns the number of ROIs
+def check_number_of_rois(simdirs, roi_counts):
+    for dir, roi_cnt in zip(simdirs, roi_counts):
+        assert roi_cnt == roi_counts[0], \
+            '%s has %d ROIs, %s has %d ROIs' % (dir, roi_cnt, simdirs[0], roi_counts[0])
+    return roi_counts[0] if roi_counts else 0
+
+# Merges single sim SimStats instances (in sim order) in one SimStats instance
+# Stats are indexed in order of first appearance, as if all sims were
+# parsed by one SimStatsBuilder
+# Sims with less than number_of_rois ROIs (e.g. still running in follow mode)
+# have masked values in the missing ROIs
+def merge_sim_stats(sim_results, number_of_rois):
+    stat_index = {}
+    for res in sim_results:
+        for name in res.stat_names:
+            stat_index.setdefault(name, len(stat_index))
+
+    ncols = np.zeros(len(stat_index), dtype=int)
+    strides = np.ones(len(stat_index), dtype=int)
+    for res in sim_results:
+        pos = np.array([stat_index[name] for name in res.stat_names], dtype=int)
+        if len(pos):
+            np.maximum.at(ncols, pos, res.ncols)
+            np.maximum.at(strides, pos, res.strides)
+    ncol_max = int(ncols.max()) if len(ncols) else 0
+
+    values = np.full((len(sim_results), number_of_rois, len(stat_index), ncol_max), np.nan)
+    for sim_cnt, res in enumerate(sim_results):
+        pos = np.array([stat_index[name] for name in res.stat_names], dtype=int)
+        if len(pos):
+            nroi = min(res.number_of_rois(), number_of_rois)
+            ncol = res.values.shape[3]
+            values[sim_cnt][:nroi, pos, :ncol] = res.values[0, :nroi]
+
+    stat_names = [None] * len(stat_index)
+    for name, idx in stat_index.items():
+        stat_names[idx] = name
+
+    return SimStats(values, stat_names, ncols, strides)
+
+# Reads the .short ROI files of one sim directory
+# Returns a SimStats instance with a single sim
+def read_short_sim_stats(dir):
+    roi_cnt = 0
+    builder = SimStatsBuilder()
+    printd('--- Directory: %s ---'%dir)
+    short_roi_list = select_rois(get_short_rois_list(dir))
+
+    with instrument.stage('read_short', dir=dir):
         for f in short_roi_list:
             roifile = dir+'/'+ f
             printd('--- Working on ROI file: %s --- '%roifile)
-            fl = open(roifile)
-
-            for ln in fl:
-                ret = parse_stat(ln)
-                new_row_df = pd.DataFrame([ [ sim_cnt, roi_cnt, ret[0], ret[1] ] ], columns=df_cols)
-                df = pd.concat([df, new_row_df], ignore_index=True)
+            with open(roifile) as fl:
+                builder.add_roi_rows(0, roi_cnt, fl)
+            instrument.add(bytes_read=os.path.getsize(roifile))
 
             roi_cnt += 1
-        sim_cnt += 1
 
-    #print_dataframe(df)
+        return builder.build(1, roi_cnt)
+
+# Builds a SimStats instance with all the stats found in the .short ROI files
+def add_stats_in_tensor(simdirs, selected_attrs):
+
+    sim_results = map_simdirs(read_short_sim_stats, simdirs)
+    number_of_rois = check_number_of_rois(simdirs, [res.number_of_rois() for res in sim_results])
+
+    with instrument.stage('merge'):
+        return merge_sim_stats(sim_results, number_of_rois)
+
+# Reads the stats.txt of one sim directory, keeping only the selected stats
+# With use_roi_index, only the selected ROIs are read, through a memory map
+# using the ROI index of stats.txt. Otherwise stats.txt is read in a single pass
+# and at most one ROI is kept in memory.
+# Returns a SimStats instance with a single sim, and the number of ROIs found
+def stream_sim_stats(dir, selector):
+    printd('--- Directory: %s ---'%dir)
+    stats_file = get_stats_file(dir)
+    builder = SimStatsBuilder()
+
+    with instrument.stage('stream', dir=dir):
+        if is_native(stats_file):
+            return read_native_sim_stats(stats_file, selector)
+
+        # Compressed stats files cannot be memory mapped, they are always
+        # decompressed as a stream
+        if use_roi_index and not is_compressed(stats_file):
+            rois = get_rois_list(dir)
+            roi_cnt = len(rois)
+            roi_numbers = select_rois(list(range(roi_cnt)))
+            roi_iter = iter_indexed_rois(stats_file, rois, roi_numbers)
+        else:
+            roi_cnt = None
+            roi_numbers = None
+            roi_iter = iter_rois(stats_file)
+
+        # Selected stat lines of each ROI
+        keep_rois = []
+        for k, roi_lines in enumerate(roi_iter):
+            roi_num = k if roi_numbers is None else roi_numbers[k]
+            printd('--- ROI #%d of %s --- ' % (roi_num, stats_file))
+            with instrument.timer('select_seconds'):
+                keep_stat_lines = select_roi_stats(roi_lines, selector)
+
+            if keep_roi_files:
+                roifile = write_file(roi_lines, roi_num, 'stats.roi.', dir)
+                write_short_roi(roifile, keep_stat_lines)
+
+            keep_rois.append(keep_stat_lines)
+
+        if roi_numbers is None:
+            roi_cnt = len(keep_rois)
+            keep_rois = select_rois(keep_rois)
+
+        with instrument.timer('parse_seconds'):
+            for roi_pos, keep_stat_lines in enumerate(keep_rois):
+                builder.add_roi_rows(0, roi_pos, keep_stat_lines)
+
+            return builder.build(1, len(keep_rois)), roi_cnt
+
+# Reads the stats of a stats.h5 or stats.json file (see native_stats.py), without text parsing
+# With a selector, only the selected stats of the selected ROIs are read, and missing
+# selected stats are masked, as in select_roi_stats. Otherwise all the stats of all the ROIs are read.
+# Stats are sorted by name, as the selected stat lines of stats.txt.
+# Returns a SimStats instance with a single sim, and the number of ROIs found
+def read_native_sim_stats(stats_file, selector=None):
+    if selector is None:
+        roi_cnt, rows = read_native_stats(stats_file, lambda name: True, lambda rois: rois)
+    else:
+        found = set()
+        def match(name):
+            matched = selector.match(name)
+            found.update(matched)
+            return matched
+        roi_cnt, rows = read_native_stats(stats_file, match, select_rois)
+        missing = selector.keys() - found
+        instrument.add(stats_kept=len(rows), stats_missing=len(missing))
+        number_of_rois = len(select_rois(list(range(roi_cnt))))
+        rows += [(name, np.full((number_of_rois, 1), np.nan)) for name in missing]
+    instrument.add(bytes_read=os.path.getsize(stats_file), rois=roi_cnt)
+
+    rows.sort(key=lambda row: row[0])
+    number_of_rois = rows[0][1].shape[0] if rows else 0
+    ncols = np.array([vals.shape[1] for _, vals in rows], dtype=int)
+    values = np.full((1, number_of_rois, len(rows), int(ncols.max()) if len(rows) else 0), np.nan)
+    for idx, (_, vals) in enumerate(rows):
+        values[0, :, idx, :vals.shape[1]] = vals
+
+    return SimStats(values, [name for name, _ in rows], ncols), roi_cnt
+
+# Streaming alternative to split.py + generate_short_ROIs + add_stats_in_tensor
+# Reads each stats.txt only once, splits it in ROIs on the fly and keeps
+# only the selected stats.
+# The stats.roi.NNNN and .short files are only written if keep_roi_files is set.
+def stream_stats_in_tensor(simdirs, selected_attrs):
+
+    selector = StatSelector(selected_attrs, stat_match_mode)
+    results = map_simdirs(stream_sim_stats, simdirs, selector)
+    check_number_of_rois(simdirs, [roi_cnt for _, roi_cnt in results])
+    sim_results = [res for res, _ in results]
+
+    with instrument.stage('merge'):
+        return merge_sim_stats(sim_results, sim_results[0].number_of_rois() if sim_results else 0)
+
+
+# Follow mode (--follow)
+#
+# Long runs dump their stats periodically. In follow mode the stats.txt of each
+# sim directory is polled every follow_interval seconds, and only the bytes
+# appended since the previous poll are read (see split.RoiTail). The selected
+# stats of each new complete ROI are added to the parsed stats of the sim,
+# and the plots are written again when any sim has new ROIs.
+
+# Parsed stats of one followed sim directory
+class SimFollower:
+    def __init__(self, dir, selector):
+        self.dir = dir
+        self.selector = selector
+        stats_file = get_stats_file(dir)
+        assert not is_compressed(stats_file), 'Only stats.txt can be followed, not %s' % stats_file
+        self.tail = RoiTail(stats_file)
+        self.builder = SimStatsBuilder()
+        self.roi_cnt = 0
+        self.sim_stats = None
+
+    # Parses the ROIs completed since the previous call
+    # Returns the number of new ROIs
+    def update(self):
+        with instrument.stage('follow', dir=self.dir):
+            rois, restarted = self.tail.read_rois()
+            if restarted:
+                print('WARNING: %s was replaced, reading it again' % self.tail.input_file)
+                self.builder = SimStatsBuilder()
+                self.roi_cnt = 0
+                self.sim_stats = None
+
+            for roi_lines in rois:
+                keep_stat_lines = select_roi_stats(roi_lines, self.selector)
+                with instrument.timer('parse_seconds'):
+                    self.builder.add_roi_rows(0, self.roi_cnt, keep_stat_lines)
+                self.roi_cnt += 1
+
+            if rois or restarted:
+                self.sim_stats = None
+            return len(rois)
+
+    # Returns a SimStats instance with the selected ROIs parsed so far
+    # The SimStats instance is built again only after new ROIs are parsed
+    def get_sim_stats(self):
+        if self.sim_stats is None:
+            all_stats = self.builder.build(1, self.roi_cnt)
+            roi_numbers = select_rois(list(range(self.roi_cnt)), running=True)
+            self.sim_stats = SimStats(all_stats.values[:, roi_numbers], all_stats.stat_names,
+                                      all_stats.ncols, all_stats.strides)
+        return self.sim_stats
+
+# Follows the stats.txt of the sim directories until interrupted (Ctrl-C),
+# or for max_polls polls if it is not None
+# Returns the last SimStats instance
+def follow_stats_in_tensor(simdirs, selected_attrs, max_polls=None):
+
+    selector = StatSelector(selected_attrs, stat_match_mode)
+    followers = [SimFollower(dir, selector) for dir in simdirs]
+    stats = None
+    polls = 0
+
+    try:
+        while max_polls is None or polls < max_polls:
+            if polls:
+                time.sleep(follow_interval)
+            polls += 1
+
+            new_rois = [follower.update() for follower in followers]
+            if not any(new_rois) and stats is not None:
+                continue
+
+            for follower, new_roi_cnt in zip(followers, new_rois):
+                if new_roi_cnt:
+                    print('INFO: %s: %d new ROIs, %d ROIs' % (follower.dir, new_roi_cnt, follower.roi_cnt))
 
-    return df
+            sim_results = [follower.get_sim_stats() for follower in followers]
+            with instrument.stage('merge'):
+                stats = merge_sim_stats(sim_results, max(res.number_of_rois() for res in sim_results))
+            stats.sim_names = get_sim_names(simdirs)
+            # Nothing to plot (and no stat names to resolve the patterns) before the first ROI
+            if stats.number_of_rois() == 0:
+                continue
+
+            # Stat name patterns of input.csv are resolved against the parsed stat names
+            get_plot_data(expand_stat_patterns(selected_attrs, StatCatalog(stats.stat_names), skip_unmatched=True),
+                          stats)
+    except KeyboardInterrupt:
+        print('INFO: Stopped following %d sims' % len(simdirs))
 
+    return stats
 
-# Filter a given Data frame accorind to a stat string (or substring)
+
+# Parsed stats cache
+#
+# All the stats of all the ROIs of a sim directory are kept in a binary cache,
+# next to stats.txt:
+# - stats.cache.npy : flat float64 array of the [roi, column] values of each stat
+#                     (see RaggedStats)
+# - stats.cache.json: stat names, number of columns and stride per stat, number of
+#                     ROIs, and the size, mtime and content hash of the parsed stats.txt
+# A cache is reused as long as stats.txt does not change, so adjusting
+# input.csv does not need a new parse of the text stats.
+# The .npy file is memory mapped and only the values of the selected stats are read.
+
+# All the stats of all the ROIs of one sim, in the ragged layout of the stats cache
+#
+# values is a flat float64 array holding the [roi, column] values of each stat,
+# stat after stat, with ncols[stat] columns from offsets[stat].
+# Unlike SimStats, the stats are not padded to the widest stat: Ruby vectors and
+# histograms have hundreds of columns, while most stats have a single column.
+class RaggedStats:
+    def __init__(self, values, stat_names, ncols, strides, number_of_rois):
+        self.values = values
+        self.stat_names = stat_names
+        self.ncols = np.asarray(ncols, dtype=np.int64)
+        self.strides = np.asarray(strides, dtype=np.int64)
+        self.number_of_rois = number_of_rois
+        sizes = self.ncols * number_of_rois
+        self.offsets = np.cumsum(sizes) - sizes
+
+    # Returns the [stat, roi] values of column cols[k] of stat stat_idx[k], in the ROIs roi_numbers
+    def columns(self, stat_idx, cols, roi_numbers):
+        stat_idx = np.asarray(stat_idx, dtype=np.int64)
+        pos = (self.offsets[stat_idx][:, None] + np.asarray(cols, dtype=np.int64)[:, None]
+               + np.asarray(roi_numbers, dtype=np.int64)[None, :] * self.ncols[stat_idx][:, None])
+        return np.asarray(self.values[pos.ravel()]).reshape(pos.shape)
+
+    # Returns the [stat, roi, column] values of the stats stat_idx in the ROIs roi_numbers,
+    # padded with nan to ncol columns
+    def dense(self, stat_idx, roi_numbers, ncol):
+        stat_idx = np.asarray(stat_idx, dtype=np.int64)
+        ret = np.full((len(stat_idx), len(roi_numbers), ncol), np.nan)
+        stat_pos, col = np.nonzero(np.arange(ncol)[None, :] < self.ncols[stat_idx][:, None])
+        if len(stat_pos):
+            ret[stat_pos, :, col] = self.columns(stat_idx[stat_pos], col, roi_numbers)
+        return ret
+
+    # Builds the ragged values of (stat name, [roi, column] values) rows
+    @classmethod
+    def from_rows(cls, rows, number_of_rois, strides=None):
+        ncols = [vals.shape[1] for _, vals in rows]
+        if strides is None:
+            strides = [1] * len(rows)
+        values = np.concatenate([vals.ravel() for _, vals in rows]) if rows else np.zeros(0)
+        return cls(values, [name for name, _ in rows], ncols, strides, number_of_rois)
+
+# Hash of the contents of a file, read in chunks
+def file_content_hash(fname):
+    h = hashlib.blake2b(digest_size=16)
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def get_cache_fnames(dir):
+    prefix = join(dir, stats_cache_prefix)
+    return prefix + '.npy', prefix + '.json'
+
+def write_cache_meta(meta_fname, meta):
+    tmp_fname = meta_fname + '.tmp'
+    with open(tmp_fname, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_fname, meta_fname)
+
+# Returns the cache metadata of a sim directory if the cache is still valid
+# for stats_file, otherwise None.
+# The content hash is computed only if the size matches but the mtime does not
+# (e.g. copied or touched files).
+def read_cache_meta(dir, stats_file):
+    npy_fname, meta_fname = get_cache_fnames(dir)
+    if not (isfile(npy_fname) and isfile(meta_fname)):
+        return None
+
+    with open(meta_fname) as f:
+        meta = json.load(f)
+
+    st = os.stat(stats_file)
+    if meta.get('version') != STATS_CACHE_VERSION or meta['size'] != st.st_size:
+        return None
+
+    if meta['mtime_ns'] != st.st_mtime_ns:
+        if meta['hash'] != file_content_hash(stats_file):
+            return None
+        meta['mtime_ns'] = st.st_mtime_ns
+        write_cache_meta(meta_fname, meta)
+
+    return meta
+
+# Parses all the stats of all the ROIs of a stats file
+# Returns a RaggedStats instance
+def parse_all_stats(stats_file):
+    if is_native(stats_file):
+        roi_cnt, rows = read_native_stats(stats_file, lambda name: True, lambda rois: rois)
+        instrument.add(bytes_read=os.path.getsize(stats_file), rois=roi_cnt)
+        rows.sort(key=lambda row: row[0])
+        return RaggedStats.from_rows(rows, roi_cnt)
+
+    builder = SimStatsBuilder()
+    roi_cnt = 0
+    for roi_lines in iter_rois(stats_file):
+        with instrument.timer('parse_seconds'):
+            builder.add_roi_rows(0, roi_cnt, roi_lines)
+        roi_cnt += 1
+    return builder.build_ragged(roi_cnt)
+
+# Parses stats_file and writes the cache of a sim directory
+# Returns the cache metadata
+def write_stats_cache(dir, stats_file):
+    npy_fname, meta_fname = get_cache_fnames(dir)
+    st = os.stat(stats_file)
+
+    with instrument.stage('cache_parse', dir=dir):
+        sim_stats = parse_all_stats(stats_file)
+        # The values of each stat are contiguous in the cache file
+        np.save(npy_fname, sim_stats.values)
+        with instrument.timer('hash_seconds'):
+            stats_hash = file_content_hash(stats_file)
+
+    meta = {'version': STATS_CACHE_VERSION,
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'hash': stats_hash,
+            'stat_names': sim_stats.stat_names,
+            'ncols': [int(x) for x in sim_stats.ncols],
+            'strides': [int(x) for x in sim_stats.strides],
+            'number_of_rois': sim_stats.number_of_rois}
+    write_cache_meta(meta_fname, meta)
+
+    return meta
+
+# Parses stats.txt of a sim directory again, only if its cache is missing or stale
+# Returns the cache metadata
+def update_stats_cache(dir):
+    stats_file = get_stats_file(dir)
+    meta = read_cache_meta(dir, stats_file)
+    if meta is None:
+        printd('--- Parsing %s (no valid cache) ---' % stats_file)
+        meta = write_stats_cache(dir, stats_file)
+    else:
+        printd('--- Using cached stats of %s ---' % stats_file)
+    return meta
+
+# Returns the cache metadata and the stats of a sim directory (a RaggedStats instance,
+# with memory mapped values). stats.txt is parsed again only if the cache is missing or stale.
+def load_stats_cache(dir):
+    meta = read_cache_meta(dir, get_stats_file(dir))
+    if meta is None:
+        meta = update_stats_cache(dir)
+
+    npy_fname, _ = get_cache_fnames(dir)
+    return meta, RaggedStats(np.load(npy_fname, mmap_mode='r'), meta['stat_names'], meta['ncols'],
+                             meta['strides'], meta['number_of_rois'])
+
+# Builds a SimStats instance with the selected stats, using the stats cache
+# of each sim directory. Only sims whose stats.txt changed are parsed again.
+def cached_stats_in_tensor(simdirs, selected_attrs):
+
+    selector = StatSelector(selected_attrs, stat_match_mode)
+
+    # Missing or stale caches are written first (in parallel with jobs > 1)
+    map_simdirs(update_stats_cache, simdirs)
+
+    # Resolve the selected stats against the cached stat names of each sim, and read
+    # their values. Only the values of the selected stats are read from the cache file.
+    stat_index = {}
+    found = set()
+    sim_blocks = []
+    roi_numbers = None
+    for dir in simdirs:
+        with instrument.stage('cache_load', dir=dir):
+            meta, cached = load_stats_cache(dir)
+            # make sure that all the simulations have the same number of ROIs
+            if roi_numbers is None:
+                roi_numbers = select_rois(list(range(cached.number_of_rois)))
+                first_roi_cnt = cached.number_of_rois
+            assert cached.number_of_rois == first_roi_cnt, \
+                '%s has %d ROIs, %s has %d ROIs' % (dir, cached.number_of_rois, simdirs[0], first_roi_cnt)
+
+            selection = []
+            sim_found = set()
+            for idx, name in enumerate(meta['stat_names']):
+                matched = selector.match(name)
+                if matched:
+                    sim_found.update(matched)
+                    selection.append((stat_index.setdefault(name, len(stat_index)), idx))
+            found |= sim_found
+
+            pos = np.array([x[0] for x in selection], dtype=int)
+            idx = np.array([x[1] for x in selection], dtype=int)
+            ncol = int(cached.ncols[idx].max()) if len(idx) else 0
+            block = cached.dense(idx, roi_numbers, ncol)
+            sim_blocks.append((meta, pos, idx, block))
+            instrument.add(bytes_read=8 * int(np.sum(cached.ncols[idx])) * len(roi_numbers),
+                           stats_kept=len(selection), stats_missing=len(selector.keys() - sim_found))
+
+    number_of_rois = len(roi_numbers) if roi_numbers is not None else 0
+
+    # Missing stats are kept as masked values
+    missing = selector.keys() - found
+    for name in sorted(missing):
+        stat_index.setdefault(name, len(stat_index))
+    instrument.add(stats_kept=len(stat_index) - len(missing), stats_missing=len(missing))
+
+    ncols = np.ones(len(stat_index), dtype=int)
+    strides = np.ones(len(stat_index), dtype=int)
+    for meta, pos, idx, _ in sim_blocks:
+        if len(pos):
+            np.maximum.at(ncols, pos, np.array(meta['ncols'])[idx])
+            np.maximum.at(strides, pos, np.array(meta['strides'])[idx])
+    ncol_max = int(ncols.max()) if len(ncols) else 0
+
+    values = np.full((len(simdirs), number_of_rois, len(stat_index), ncol_max), np.nan)
+    for sim_cnt, (_, pos, _, block) in enumerate(sim_blocks):
+        if len(pos):
+            values[sim_cnt][:, pos, :block.shape[2]] = block.transpose(1, 0, 2)
+
+    stat_names = [None] * len(stat_index)
+    for name, idx in stat_index.items():
+        stat_names[idx] = name
+
+    return SimStats(values, stat_names, ncols, strides)
+
+
+# Row positions of a stats DataFrame (see SimStats.to_dataframe),
+# grouped by stat name and by (stat name, sim).
+# The grouping is done once, so that each lookup does not scan the whole DataFrame,
+# nor all the rows of a sim.
+class DataFrameIndex:
+    def __init__(self, df):
+        self.df = df
+        self.by_stat = df.groupby(df_cols[2], sort=False).indices
+        self.by_stat_sim = df.groupby([df_cols[2], df_cols[0]], sort=False).indices
+
+    # Positions of the rows of the stats matching filter_str,
+    # optionally only of one sim (sim_cnt)
+    def rows(self, filter_str, match_mode='exact', sim_cnt=None):
+        names = find_stat_names(self.by_stat, filter_str, match_mode)
+        if sim_cnt is None:
+            groups = [self.by_stat[name] for name in names]
+        else:
+            groups = [self.by_stat_sim[(name, sim_cnt)] for name in names if (name, sim_cnt) in self.by_stat_sim]
+        if not groups:
+            return np.zeros(0, dtype=np.intp)
+        rows = np.concatenate(groups)
+        if len(groups) > 1:
+            rows.sort()
+        return rows
+
+# Returns the keys of stat_index (stat name -> anything) that match pattern
+# See SimStats.find for the match modes
+def find_stat_names(stat_index, pattern, match_mode='exact'):
+    pattern = pattern.strip()
+    if match_mode == 'exact':
+        return [pattern] if pattern in stat_index else []
+    elif match_mode == 'substring':
+        return [name for name in stat_index if pattern in name]
+    elif match_mode == 'glob':
+        return [name for name in stat_index if fnmatch.fnmatchcase(name, pattern)]
+    assert 0, 'Unknown match_mode: %s' % match_mode
+
+# Filter a given Data frame (through its DataFrameIndex) according to a stat string
+# By default only the stat named filter_str is kept, see SimStats.find for the other modes
 # We are stripping the filter_str because sometimes the selected attrs contain spaces in purpose
 # E.g. If we want to get busUtil stat, but not busUtilRead or busUtilWrite
-#
-def filter_dataframe(df, filter_str):
-    filtered_df = df[df['stat_name'].str.contains(filter_str.strip())]
-    return filtered_df
+def filter_dataframe(index, filter_str, match_mode='exact', sim_cnt=None):
+    return index.df.iloc[index.rows(filter_str, match_mode, sim_cnt)]
 
 # prints a dataframe row by row
 def print_dataframe(df):
@@ -304,10 +1233,14 @@ def autolabel(rects, ax):
     """
     Attach a text label above each bar displaying its height.
     """
+    import matplotlib.pyplot as plt
     max = 0
     for rect in rects:
         for bar in rect:
             height = bar.get_height()
+            # Masked values (missing stats or nan) have no bar
+            if np.isnan(height):
+                continue
             if height > max:
                 max = height
                 plt.ylim([1, height*2])
@@ -318,63 +1251,80 @@ def autolabel(rects, ax):
                         textcoords="offset points",
                         ha='center', va='bottom', rotation=90)
 
-def get_plot_data(selected_attrs, df):
-
-    if Create_pdf:
-        pp = PdfPages(graph_pdf_fname)
-
-    plot_num = 0
-    barwidth = 0.2
+# One page (figure) of graphs_out.pdf
+# values[sim, roi] are the bar heights, nan values (missing stats, divisions by zero) are not drawn
+# labels[sim] are the names of the sims in the legend
+# kind is the plot type (see plot_mode), aggregates[name][roi] are the
+# aggregates of the sims (see aggregate_sims) drawn in 'box' plots
+class PlotPage:
+    def __init__(self, title, ylabel, values, labels, kind='bars'):
+        self.title = title
+        self.ylabel = ylabel
+        self.values = values
+        self.labels = labels
+        self.kind = kind
+        self.aggregates = None
+
+    # Hash of everything that is drawn in the page:
+    # stat names (title), values, labels and style (colors, heatmap ticks)
+    # (the aggregates are computed from the values)
+    def key(self):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(repr((PLOT_STYLE_VERSION, self.kind, self.title, self.ylabel, self.values.shape,
+                       self.labels, g_colors, max_heatmap_labels)).encode())
+        h.update(np.ascontiguousarray(self.values, dtype=np.float64).tobytes())
+        return h.hexdigest()
+
+# Returns the names of the sims in the plots: labels if they are set,
+# otherwise the names of the sim directories
+def get_labels(stats):
+    return get_sim_labels(stats.sim_names or ['sim %d' % k for k in range(stats.number_of_sims())])
+
+# Returns the labels of the sims with the given names
+def get_sim_labels(names):
+    if labels is None:
+        return list(names)
+    return list(labels[:len(names)]) + list(names[len(labels):])
+
+# Returns the [sim, roi, column] values of a stat, that are used in the graphs, or None
+# stat_type (the second column of input.csv) selects the value, percent or
+# cumulative percent columns of value / percent / cumulative percent triplets
+def get_stat_values(stats, name, stat_type='value'):
+    return stats.get_columns(name, stat_type)
+
+# Computes the plot pages of all the selected attrs
+# Returns a list of PlotPage instances, in input order
+def get_plot_pages(selected_attrs, stats):
+
+    pages = []
+    sim_labels = get_labels(stats)
 
     for attr in selected_attrs:
 
-        if not attr.isComplex:
-            printd('Plotting : \'%s\'' % attr.name)
-        else:
-            printd('Plotting : \'%s\' / \'%s\'' % (attr.name, attr.name2))
-
-        fdf = filter_dataframe(df, attr.name)
-        fdf = fdf.copy()
-
-        if attr.isComplex:
-            fdf2 = filter_dataframe(df, attr.name2)
-            fdf2 = fdf2.copy()
+        printd('Plotting : \'%s\'' % attr.expr)
 
-        number_of_rois = fdf[fdf['sim_cnt'] == 0].shape[0]
-
-        # make sure that all the simulations have the same number of ROIs
-        # as the first simulation
-        for i in np.arange(1, number_of_sims):
-           assert(number_of_rois == fdf[fdf['sim_cnt'] == i].shape[0])
-
-        if fdf.empty:
-            print(f'WARNING:{attr.name} dataframe is empty')
+        # [sim, roi, column] values of the stat (or of the stat expression)
+        # Complex stats are evaluated over all the sims and ROIs at once,
+        # divisions with 0 values give nan values, which are not drawn
+        try:
+            vals = attr.expr.evaluate(lambda name: get_stat_values(stats, name, attr.type))
+        except KeyError as e:
+            print(f'WARNING:{e.args[0]} is not found in the parsed stats')
+            continue
+        except ValueError as e:
+            print('ERROR: Could not plot attribute %s: %s' % (attr.name, e))
             continue
 
         try:
+            if np.ndim(vals) != 3:
+                print('ERROR: %s does not contain any stats' % attr.name)
+                continue
+
+            value_len = vals.shape[2]
 
-            # Convert the stat_values to floats
-            fdf['stat_value'] = fdf['stat_value'].apply(lambda lst: [float(x) for x in lst])
-            if attr.isComplex:
-                fdf2['stat_value'] = fdf2['stat_value'].apply(lambda lst: [float(x) for x in lst])
-
-            # Count the number of values in value list
-            # This is usually 1, 4 or 12
-            value_len =  len(fdf['stat_value'].iloc[0])
-
-            if attr.isComplex:
-                value_len2 = len(fdf2['stat_value'].iloc[0])
-
-            if(value_len == 12):
-                # Keep first of every 3 values
-                # TODO: if percent is specified keep second value of every 3 values
-                # TODO: if cumm_percent is specified keep third value of every 3 values
-                #
-                fdf['stat_value'] = fdf['stat_value'].apply(lambda x: [x[i] for i in [0, 3, 6, 9]])
-                value_len = 4
-            if attr.isComplex and value_len2 == 12:
-                fdf2['stat_value'] = fdf2['stat_value'].apply(lambda x: [x[i] for i in [0, 3, 6, 9]])
-                value_len2 = 4
+            # If attr.calculation is specified in input file just divide stat values by attr.calculation
+            if attr.calculation > 0:
+                vals = vals / attr.calculation
 
             if (value_len == 1) or (value_len == 4):
 
@@ -382,99 +1332,613 @@ def get_plot_data(selected_attrs, df):
                 # then we need to create a separate figure for each of the columns
                 # Usually each column represents a single VNET (VNETs 0 to 3)
                 for stat_column in np.arange(0, value_len):
-                    rects = []
-                    pltfig = plt.figure(plot_num, figsize=(12, 6))
-                    plot_num += 1
-                    ax = plt.subplot()
-                    ax.grid(True)
-                    plt.grid(True)
-
-                    for i in np.arange(0, number_of_sims):
-
-                        # Simple case where attr is not complex and we only plot 1 stat
-                        # If attr.calculation is specified in input file just divide stat values by attr.calculation
-                        if not attr.isComplex:
-                            if attr.calculation > 0:
-                                rect = ax.bar( range(i, number_of_rois*number_of_sims, number_of_sims),
-                                                fdf[fdf['sim_cnt'] == i]['stat_value'].apply(lambda x: x[stat_column]).div(attr.calculation),
-                                        color = g_colors[i%len(g_colors)], width=barwidth, label=labels[i])
-                            else:
-                                rect = ax.bar( range(i, number_of_rois*number_of_sims, number_of_sims),
-                                            fdf[fdf['sim_cnt'] == i]['stat_value'].apply(lambda x: x[stat_column]),
-                                    color = g_colors[i%len(g_colors)], width=barwidth, label=labels[i])
-                        #
-                        # More complex case, where we plot a stat divided by a second stat
-                        #
-                        else:
-                            assert(not fdf2.empty)
-                            df_vals = fdf[fdf['sim_cnt'] == i]['stat_value'].apply(lambda x: x[0]).reset_index(drop=True)
-                            df2_vals = fdf2[fdf2['sim_cnt'] == i]['stat_value'].apply(lambda x: x[0]).reset_index(drop=True)
-
-                            # if df2_vals contain zeros then we cannot plot these simulations
-                            if 0.0 in df2_vals.values:
-                                print(f'Cannot plot sim_cnt {i}, for stat {attr.name2}: division with 0 value')
-                                continue
-
-                            if attr.calculation > 0:
-                                rect = ax.bar( range(i, number_of_rois*number_of_sims, number_of_sims),
-                                                df_vals.div(df2_vals).div(attr.calculation),
-                                        color = g_colors[i%len(g_colors)], width=barwidth, label=labels[i])
-                            else:
-                                rect = ax.bar( range(i, number_of_rois*number_of_sims, number_of_sims),
-                                                df_vals.div(df2_vals),
-                                        color = g_colors[i%len(g_colors)], width=barwidth, label=labels[i])
-
-                        rects.append(rect)
-
-                    # Generate a value label for each bar on the plot
-                    autolabel(rects, ax)
-
-                    plt.gca().set_ylim(bottom=0)
-
-                    plt.xlabel('ROI #')
-                    plt.ylabel(attr.description)
-                    plt.legend(title='sim_cnt')
 
                     if (value_len == 4):
                         suffix = ' - VNET: %s'% VNETS[stat_column]
                     else:
                         suffix = ''
 
-                    if not attr.isComplex:
-                        plt.title('%s%s' % (attr.name, suffix), pad = 10)
-                    else:
-                        plt.title('%s / %s%s' % (attr.name, attr.name2,suffix), pad = 10)
+                    title = '%s%s' % (attr.expr, suffix)
+                    if attr.type != 'value':
+                        title += ' (%s)' % attr.type
 
-                    plt.xticks([r*number_of_sims for r in range(number_of_rois)], np.arange(0,number_of_rois))
-                    pp.savefig(pltfig, dpi=300, bbox_inches='tight')
+                    pages.append(PlotPage(title, attr.description,
+                                          np.ascontiguousarray(vals[:, :, stat_column]), sim_labels))
 
         except Exception as e:
             print('Could not plot attribute: %s' % attr.name)
             print(e)
             print(traceback.format_exc())
-            print('%s' % fdf)
-            if attr.isComplex:
-                print('%s' % fdf2)
+            print('%s' % vals)
             #exit(-1)
 
-    pp.close()
+    return pages
+
+# Draws a plot page, returns the figure
+def render_page(page):
+    if page.kind == 'heatmap':
+        return render_heatmap(page)
+    if page.kind == 'box':
+        return render_box(page)
+
+    import matplotlib.pyplot as plt
+    barwidth = 0.2
+    number_of_sims, number_of_rois = page.values.shape
+
+    rects = []
+    pltfig = plt.figure(figsize=(12, 6))
+    ax = plt.subplot()
+    ax.grid(True)
+    plt.grid(True)
+
+    for i in np.arange(0, number_of_sims):
+        rect = ax.bar( range(i, number_of_rois*number_of_sims, number_of_sims),
+                        page.values[i],
+                color = g_colors[i%len(g_colors)], width=barwidth, label=page.labels[i])
+
+        rects.append(rect)
+
+    # Generate a value label for each bar on the plot
+    autolabel(rects, ax)
+
+    plt.gca().set_ylim(bottom=0)
+
+    plt.xlabel('ROI #')
+    plt.ylabel(page.ylabel)
+    plt.legend(title='sim_cnt')
+    plt.title(page.title, pad = 10)
+
+    plt.xticks([r*number_of_sims for r in range(number_of_rois)], np.arange(0,number_of_rois))
+    return pltfig
+
+# Tick positions and labels, at most max_ticks of them
+def sparse_ticks(tick_labels, max_ticks):
+    step = max(1, -(-len(tick_labels) // max_ticks))
+    return list(range(0, len(tick_labels), step)), list(tick_labels[::step])
+
+# Draws the [sim, roi] values of a page as an image, one row per sim
+# The drawing cost does not depend on the number of sims
+def render_heatmap(page):
+    import matplotlib.pyplot as plt
+    number_of_sims, number_of_rois = page.values.shape
+
+    pltfig, ax = plt.subplots(figsize=(12, min(24, 4 + 0.12 * number_of_sims)))
+    # Masked values (missing stats or nan) are not drawn
+    img = ax.imshow(np.ma.masked_invalid(page.values), aspect='auto', interpolation='none')
+    pltfig.colorbar(img, ax=ax, label=page.ylabel)
+
+    ax.set_yticks(*sparse_ticks(page.labels, max_heatmap_labels))
+    ax.set_xticks(*sparse_ticks(np.arange(number_of_rois), max_heatmap_labels))
+    ax.set_xlabel('ROI #')
+    ax.set_ylabel('sim')
+    ax.set_title(page.title, pad = 10)
+    return pltfig
+
+# Draws one box per ROI with the distribution of the sims (see aggregate_sims):
+# quartiles, median, mean, and whiskers from the minimum to the maximum
+# The boxes are drawn from the aggregates, so the drawing cost does not
+# depend on the number of sims
+def render_box(page):
+    import matplotlib.pyplot as plt
+    agg = page.aggregates
+    number_of_rois = page.values.shape[1]
+
+    pltfig, ax = plt.subplots(figsize=(12, 6))
+    ax.grid(True)
+    # ROIs without values (in all the sims) have no box
+    rois = [roi for roi in range(number_of_rois) if agg['count'][roi]]
+    boxes = [{'label': str(roi), 'whislo': agg['min'][roi], 'q1': agg['p25'][roi], 'med': agg['p50'][roi],
+              'q3': agg['p75'][roi], 'whishi': agg['max'][roi], 'mean': agg['mean'][roi], 'fliers': []}
+             for roi in rois]
+    if boxes:
+        ax.bxp(boxes, positions=rois, showmeans=True, showfliers=False)
+
+    ax.set_xlabel('ROI #')
+    ax.set_ylabel(page.ylabel)
+    ax.set_title('%s (%d sims)' % (page.title, len(page.labels)), pad = 10)
+    return pltfig
+
+# Draws the given pages and saves them in a pdf file
+# Each figure is closed after it is saved, so only one figure is open at a time
+def save_plot_pages(pages, pdf_fname):
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
+    with PdfPages(pdf_fname) as pp:
+        for page in pages:
+            with instrument.stage('render', page=page.title):
+                with instrument.timer('draw_seconds'):
+                    pltfig = render_page(page)
+                pp.savefig(pltfig, dpi=300, bbox_inches='tight')
+                plt.close(pltfig)
+    return pdf_fname
+
+# Merges pdf files in one pdf file, in the given order (needs pypdf)
+def merge_pdf_files(fnames, pdf_fname):
+    from pypdf import PdfWriter
+
+    with instrument.stage('merge_pdf'):
+        writer = PdfWriter()
+        for fname in fnames:
+            writer.append(fname)
+        # Fonts and other objects repeated in each file are kept once
+        if hasattr(writer, 'compress_identical_objects'):
+            writer.compress_identical_objects()
+        with open(pdf_fname, 'wb') as f:
+            writer.write(f)
+
+# Draws the pages in a pool of jobs processes
+# Each process saves a contiguous chunk of pages in a temporary pdf file,
+# and the chunks are merged in graph_pdf_fname in input order (needs pypdf)
+def save_plot_pages_parallel(pages, pdf_fname):
+    # A few chunks per process, for load balancing
+    nchunks = min(len(pages), jobs * 4)
+    bounds = np.linspace(0, len(pages), nchunks + 1).astype(int)
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(pdf_fname))) as tmpdir:
+        chunk_fnames = [join(tmpdir, 'chunk%04d.pdf' % k) for k in range(nchunks)]
+        chunks = [pages[bounds[k]:bounds[k + 1]] for k in range(nchunks)]
+
+        with worker_pool(jobs) as executor:
+            if instrument.enabled:
+                chunk_fnames = instrument.merge(executor.map(instrument.collect, repeat(save_plot_pages),
+                                                             chunks, chunk_fnames))
+            else:
+                chunk_fnames = list(executor.map(save_plot_pages, chunks, chunk_fnames))
+
+        merge_pdf_files(chunk_fnames, pdf_fname)
+
+    return pdf_fname
+
+# Saves a single page pdf file in the plot cache
+def save_cached_page(page, fname):
+    tmp_fname = fname + '.tmp'
+    save_plot_pages([page], tmp_fname)
+    os.replace(tmp_fname, fname)
+    return fname
+
+# Each page is kept as a single page pdf file in plot_cache_dir, named by
+# its key (PlotPage.key). Only the pages that are not found in the cache are
+# drawn (in parallel with jobs > 1), then all the pages are merged in
+# graph_pdf_fname in input order (needs pypdf).
+# The files of pages that are no longer drawn are removed, so the cache holds
+# only the pages of the last run.
+def save_plot_pages_cached(pages, pdf_fname):
+    os.makedirs(plot_cache_dir, exist_ok=True)
+    page_fnames = [join(plot_cache_dir, page.key() + '.pdf') for page in pages]
+
+    missing = {}
+    for page, fname in zip(pages, page_fnames):
+        if not isfile(fname):
+            missing[fname] = page
+    printd('INFO: %d of %d plots found in %s' % (len(pages) - len(missing), len(pages), plot_cache_dir))
+
+    if jobs > 1 and len(missing) > 1:
+        with worker_pool(jobs) as executor:
+            if instrument.enabled:
+                instrument.merge(executor.map(instrument.collect, repeat(save_cached_page),
+                                              missing.values(), missing.keys()))
+            else:
+                list(executor.map(save_cached_page, missing.values(), missing.keys()))
+    else:
+        for fname, page in missing.items():
+            save_cached_page(page, fname)
+
+    merge_pdf_files(page_fnames, pdf_fname)
+    prune_plot_cache(page_fnames)
+
+    return pdf_fname
+
+# Names of the page files of plot_cache_dir (and of the pages being written)
+PLOT_CACHE_FNAME = re.compile(r'[0-9a-f]{32}\.pdf(\.tmp)?')
+
+# Removes the page files of plot_cache_dir that are not in page_fnames
+# Other files and directories are left alone
+def prune_plot_cache(page_fnames):
+    keep = set(os.path.basename(fname) for fname in page_fnames)
+    for fname in listdir(plot_cache_dir):
+        path = join(plot_cache_dir, fname)
+        if fname not in keep and PLOT_CACHE_FNAME.fullmatch(fname) and isfile(path):
+            os.remove(path)
+
+# Sim comparison
+#
+# Bars are readable for a few sims only. With more than max_bar_sims sims
+# (or with plot_mode set to 'heatmap' or 'box') each page shows all the sims at
+# once, and the aggregates of the sims in each ROI are written in compare_csv_fname.
+
+# Returns the plot type of the pages, for a given number of sims
+def get_plot_kind(number_of_sims):
+    if plot_mode == 'auto':
+        return 'bars' if number_of_sims <= max_bar_sims else 'heatmap'
+    assert plot_mode in PLOT_MODES, 'Unknown plot_mode: %s' % plot_mode
+    return plot_mode
+
+# Aggregates of the sims in each ROI, computed for all the pages at once
+# values[page, sim, roi] -> {name: [page, roi] array}, with names:
+# count (number of sims with a value), mean, min, max, and pN for each percentile N
+# of compare_percentiles (the quartiles are always computed, for box plots).
+# Masked values (nan) are ignored.
+def aggregate_sims(values):
+    percentiles = sorted(set(compare_percentiles) | {25, 50, 75})
+    ret = {'count': np.sum(~np.isnan(values), axis=1)}
+    # ROIs without values give nan aggregates
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        ret['mean'] = np.nanmean(values, axis=1)
+        ret['min'] = np.nanmin(values, axis=1)
+        ret['max'] = np.nanmax(values, axis=1)
+        for q, p in zip(percentiles, np.nanpercentile(values, percentiles, axis=1)):
+            ret['p%g' % q] = p
+    return ret
+
+# Writes the aggregates of the pages, one row per page and ROI
+def write_compare_rows(writer, pages, aggregates):
+    names = list(aggregates)
+    for k, page in enumerate(pages):
+        for roi in range(page.values.shape[1]):
+            writer.writerow([page.title, roi] + ['%g' % aggregates[name][k, roi] for name in names])
+
+# Turns the pages into sim comparison pages of the given kind
+# With baseline_sim set, the values of each sim are divided by the values of the baseline sim
+# The pages are compared all at once, or with memory_budget set, in blocks of pages
+# that fit in a quarter of memory_budget (the percentiles copy the values)
+def compare_sims(pages, kind):
+    if not pages:
+        return pages
+
+    if baseline_sim is not None:
+        if baseline_sim not in pages[0].labels:
+            print('ERROR: Baseline sim %s not found in %s' % (baseline_sim, ', '.join(pages[0].labels)))
+            sys.exit()
+        base = pages[0].labels.index(baseline_sim)
+
+    block_size = len(pages)
+    if memory_budget is not None:
+        block_size = max(1, memory_budget // 4 // max(pages[0].values.nbytes, 1))
+
+    with open(compare_csv_fname, 'w', newline='') as f:
+        writer = csv.writer(f)
+        for start in range(0, len(pages), block_size):
+            block = pages[start:start + block_size]
+            values = np.stack([page.values for page in block])
+            if baseline_sim is not None:
+                values = divide(values, values[:, base:base + 1, :])
+
+            aggregates = aggregate_sims(values)
+            if start == 0:
+                writer.writerow(['title', 'roi'] + list(aggregates))
+            write_compare_rows(writer, block, aggregates)
+
+            for k, page in enumerate(block):
+                page.kind = kind
+                page.aggregates = {name: agg[k] for name, agg in aggregates.items()}
+                if baseline_sim is not None:
+                    # Spilled pages (see memory_budget) are divided in place
+                    if isinstance(page.values, np.memmap):
+                        page.values[:] = values[k]
+                    else:
+                        page.values = values[k]
+                    page.ylabel = '%s (vs %s)' % (page.ylabel, baseline_sim)
+    return pages
+
+def get_plot_data(selected_attrs, stats):
+
+    with instrument.stage('plot_pages'):
+        pages = get_plot_pages(selected_attrs, stats)
+
+    return save_plots(pages, stats.number_of_sims())
+
+# Compares the sims (see plot_mode) and draws the pages in graph_pdf_fname
+def save_plots(pages, number_of_sims):
+
+    kind = get_plot_kind(number_of_sims)
+    if kind != 'bars' or baseline_sim is not None:
+        with instrument.stage('compare'):
+            pages = compare_sims(pages, kind)
+
+    if not Create_pdf:
+        return 0
+
+    if use_plot_cache or (jobs > 1 and len(pages) > 1):
+        try:
+            import pypdf
+        except ImportError:
+            print('WARNING: pypdf is needed for the plot cache and to render the plots in parallel, '
+                  'rendering all the plots with one process')
+        else:
+            if use_plot_cache:
+                save_plot_pages_cached(pages, graph_pdf_fname)
+            else:
+                save_plot_pages_parallel(pages, graph_pdf_fname)
+            return 0
+
+    save_plot_pages(pages, graph_pdf_fname)
     return 0
 
 
+# Out-of-core mode (--memory-budget)
+#
+# By default the selected stats of all the sims are parsed in one SimStats instance,
+# whose size grows with the number of sims. With memory_budget set:
+# 1. the sims are parsed in chunks, whose values fit in half of memory_budget,
+#    and the values of each chunk are spilled to spill_dir (chunk.NNNN.npy, with
+#    the stat names in chunk.NNNN.json). The first chunk holds a single sim,
+#    to measure the size of the values of a sim.
+# 2. the values of the plot pages are computed chunk by chunk, and written
+#    in a memory mapped [page, sim, roi] file (spill_dir/pages.npy)
+# 3. the pages are compared (see compare_sims) and drawn one block of pages at a time
+# So the peak memory depends on memory_budget and on the size of one page,
+# not on the number of sims. spill_dir is removed at the end.
+
+def get_spill_fnames(chunk_cnt):
+    prefix = join(spill_dir, 'chunk.%04d' % chunk_cnt)
+    return prefix + '.npy', prefix + '.json'
+
+# Parses the selected stats of the sim directories chunk by chunk,
+# and spills the values of each chunk
+# Returns the chunks (lists of sim directories) and the number of ROIs
+def spill_sim_chunks(simdirs, selected_attrs):
+    chunks = []
+    number_of_rois = None
+    chunk_size = 1
+    start = 0
+
+    while start < len(simdirs):
+        chunk = simdirs[start:start + chunk_size]
+        with instrument.stage('spill', sims=len(chunk)):
+            stats = parse_stats(chunk, selected_attrs)
+            if number_of_rois is None:
+                number_of_rois = stats.number_of_rois()
+            assert stats.number_of_rois() == number_of_rois, \
+                '%s has %d ROIs, %s has %d ROIs' % (chunk[0], stats.number_of_rois(), simdirs[0], number_of_rois)
+
+            npy_fname, meta_fname = get_spill_fnames(len(chunks))
+            np.save(npy_fname, stats.values)
+            write_cache_meta(meta_fname, {'sim_names': stats.sim_names,
+                                          'stat_names': stats.stat_names,
+                                          'ncols': [int(x) for x in stats.ncols],
+                                          'strides': [int(x) for x in stats.strides]})
+            instrument.add(bytes_written=stats.values.nbytes)
+
+        if start == 0:
+            chunk_size = max(1, memory_budget // 2 // max(stats.values.nbytes, 1))
+            printd('INFO: Parsing %d sims per chunk' % chunk_size)
+        chunks.append(chunk)
+        start += len(chunk)
+        del stats
+
+    return chunks, number_of_rois
+
+def read_spill_meta(chunk_cnt):
+    _, meta_fname = get_spill_fnames(chunk_cnt)
+    with open(meta_fname) as f:
+        return json.load(f)
+
+# Stats of all the chunks, indexed in order of first appearance (as in merge_sim_stats)
+# Returns the stat names, and their number of columns and strides
+def get_spilled_stats(number_of_chunks):
+    stat_index = {}
+    ncols = []
+    strides = []
+    for chunk_cnt in range(number_of_chunks):
+        meta = read_spill_meta(chunk_cnt)
+        for name, ncol, stride in zip(meta['stat_names'], meta['ncols'], meta['strides']):
+            idx = stat_index.setdefault(name, len(stat_index))
+            if idx == len(ncols):
+                ncols.append(ncol)
+                strides.append(stride)
+            else:
+                ncols[idx] = max(ncols[idx], ncol)
+                strides[idx] = max(strides[idx], stride)
+    return list(stat_index), np.array(ncols, dtype=int), np.array(strides, dtype=int)
+
+# Reads back the values of a chunk, with the stats of all the chunks
+# (stats missing in the chunk are masked)
+# Returns a SimStats instance with the sims of the chunk
+def load_spilled_chunk(chunk_cnt, stat_names, ncols, strides):
+    npy_fname, _ = get_spill_fnames(chunk_cnt)
+    meta = read_spill_meta(chunk_cnt)
+    chunk_values = np.load(npy_fname, mmap_mode='r')
+    stat_index = {name: idx for idx, name in enumerate(stat_names)}
+
+    number_of_sims, number_of_rois, _, ncol = chunk_values.shape
+    values = np.full((number_of_sims, number_of_rois, len(stat_names), int(ncols.max()) if len(ncols) else 0), np.nan)
+    pos = np.array([stat_index[name] for name in meta['stat_names']], dtype=int)
+    if len(pos):
+        values[:, :, pos, :ncol] = chunk_values
+    instrument.add(bytes_read=chunk_values.nbytes)
+
+    stats = SimStats(values, stat_names, ncols, strides)
+    stats.sim_names = meta['sim_names']
+    return stats
+
+# Computes the plot pages of the selected attrs chunk by chunk
+# Returns a list of PlotPage instances, whose values are rows of spill_dir/pages.npy
+def get_spilled_plot_pages(selected_attrs, chunks, number_of_rois):
+    if not chunks:
+        return []
+    stat_names, ncols, strides = get_spilled_stats(len(chunks))
+    selected_attrs = expand_stat_patterns(selected_attrs, StatCatalog(stat_names))
+
+    number_of_sims = sum(len(chunk) for chunk in chunks)
+    sim_names = []
+    pages = None
+    for chunk_cnt, chunk in enumerate(chunks):
+        with instrument.stage('plot_pages', sims=len(chunk)):
+            stats = load_spilled_chunk(chunk_cnt, stat_names, ncols, strides)
+            if pages is None:
+                chunk_pages = get_plot_pages(selected_attrs, stats)
+                page_values = np.lib.format.open_memmap(join(spill_dir, 'pages.npy'), mode='w+', dtype=np.float64,
+                                                        shape=(len(chunk_pages), number_of_sims, number_of_rois))
+                pages = [PlotPage(page.title, page.ylabel, page_values[k], None)
+                         for k, page in enumerate(chunk_pages)]
+            else:
+                # All the chunks have the same stats, so their warnings are printed only once
+                with contextlib.redirect_stdout(io.StringIO()):
+                    chunk_pages = get_plot_pages(selected_attrs, stats)
+            assert len(chunk_pages) == len(pages)
+
+            start = len(sim_names)
+            for page, chunk_page in zip(pages, chunk_pages):
+                page.values[start:start + len(chunk)] = chunk_page.values
+            sim_names += stats.sim_names
+            del stats, chunk_pages
+
+    sim_labels = get_sim_labels(sim_names)
+    for page in pages:
+        page.labels = sim_labels
+    return pages
+
+# Parses the sim directories chunk by chunk (see memory_budget), and draws the plots
+# of the selected attrs in graph_pdf_fname
+def save_plots_out_of_core(simdirs, selected_attrs):
+    shutil.rmtree(spill_dir, ignore_errors=True)
+    os.makedirs(spill_dir)
+    try:
+        chunks, number_of_rois = spill_sim_chunks(simdirs, selected_attrs)
+        pages = get_spilled_plot_pages(selected_attrs, chunks, number_of_rois)
+        with instrument.stage('plot'):
+            save_plots(pages, len(simdirs))
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+# Library API
+#
+# gem5_parser.py can be imported, e.g. from scripts that run many sweeps:
+#   import gem5_parser as gp
+#   gp.Debug = False
+#   selected_attrs, stats = gp.load_stats('input/input.csv', 'runs/sweep_0042')
+#   ipc = stats.get('system.cpu.ipc')[:, :, 0]  # [sim, roi] values
+#   gp.get_plot_data(selected_attrs, stats)  # graphs_out.pdf
+# The configuration below (e.g. use_stats_cache, jobs, labels) is read when the
+# functions are called, so it can be set as module attributes.
+# matplotlib and pandas are imported only when plots are drawn or a DataFrame is built.
+
+# Returns the sim directories of path: the directories whose name
+# contains one of the strings of filter_str_list
+def get_simdirs(path):
+    simdirs = set()
+    for filter_str in filter_str_list:
+        simdirs.update(get_dirs_current_path(path, filter_str))
+    return sorted(simdirs)
+
+# Parses the selected stats of the sim directories, with the stats cache
+# (use_stats_cache), in a single pass (stream_stats), or from the ROI files of split.py
+# Returns a SimStats instance
+def parse_stats(simdirs, selected_attrs):
+    if use_stats_cache:
+        stats = cached_stats_in_tensor(simdirs, selected_attrs)
+    elif stream_stats:
+        stats = stream_stats_in_tensor(simdirs, selected_attrs)
+    else:
+        # Could skip this step if already generated
+        # This needs to be called everytime we adjust the input.csv file
+        generate_short_ROIs(simdirs, selected_attrs)
+
+        stats = add_stats_in_tensor(simdirs, selected_attrs)
+
+    stats.sim_names = get_sim_names(simdirs)
+    return stats
+
+# Names of the sim directories
+def get_sim_names(simdirs):
+    return [os.path.basename(os.path.normpath(dir)) for dir in simdirs]
+
+# Parses the stats selected in input_csv, for the sim directories of path
+# (the current directory by default)
+# Returns the selected stats, with their stat name patterns resolved, and the SimStats instance
+def load_stats(input_csv='./input/input.csv', path=None):
+    if path is None:
+        simdirs = get_simdirs(os.getcwd())
+    else:
+        simdirs = [join(path, dir) for dir in get_simdirs(path)]
+
+    selected_attrs = get_attr_from_csv(input_csv)
+    stats = parse_stats(simdirs, selected_attrs)
+
+    return expand_stat_patterns(selected_attrs, StatCatalog(stats.stat_names)), stats
+
+
 ##### MAIN ####
 
 # AMBA CHI VNETs
 VNETS = ['REQ', 'SNP', 'RESP', 'DAT']
 
-# You can adjust these labels according to your simulations
-labels = ['sim_0001', 'sim_0002', 'sim_0003', 'sim_0004' ]
+# You can adjust these labels according to your simulations,
+# e.g. labels = ['baseline', 'prefetcher', ...]
+# By default (None) the names of the sim directories are used
+labels = None
+
+# How the sims are compared in each plot (can be set with --plot-mode):
+# 'bars'   : one bar per sim and ROI, readable for a few sims
+# 'heatmap': one row per sim and one column per ROI
+# 'box'    : one box per ROI, with the distribution of the values of the sims
+# 'auto'   : 'bars' up to max_bar_sims sims, 'heatmap' for more sims
+PLOT_MODES = ['bars', 'heatmap', 'box']
+plot_mode = 'auto'
+max_bar_sims = 8
+# Maximum number of sim (and ROI) labels of heatmap axes
+max_heatmap_labels = 40
+
+# Sim (label) whose values are 1.0 in the plots, the values of the other sims
+# are divided by its values (can be set with --baseline), or None
+baseline_sim = None
+
+# In sim comparison plots, the mean, minimum, maximum and these percentiles of
+# the sims in each ROI are written in compare_csv_fname
+compare_percentiles = [5, 25, 50, 75, 95]
+compare_csv_fname = 'compare_summary.csv'
 
 # The last ROI starts when our benchmark kernel finishes
 # and until the simulator shuts down. Usually we don't need this ROI
 # so we ignore it.
 ignore_last_roi = True
 
-plt.rcParams.update({'figure.max_open_warning': 0})
+# Parse stats.txt directly in a single pass, without running split.py first.
+# Set to False to work on the stats.roi.NNNN files generated by split.py
+stream_stats = True
+
+# In streaming mode, also write the stats.roi.NNNN and .short files
+keep_roi_files = False
+
+# In streaming mode, read the ROIs through a memory map, using a byte-offset
+# index of the ROIs of stats.txt (stats.txt.idx), so only the selected ROIs are read
+use_roi_index = True
+
+# Read the stats.h5 or stats.json files written by gem5 (see native_stats.py) instead
+# of stats.txt, when they are found. They are read without text parsing.
+# Sims without stats.txt are always read from their stats.h5 / stats.json.
+use_native_stats = False
+
+# Python slice of the ROIs to parse, applied after ignore_last_roi
+# e.g. slice(-3, None) for the last 3 ROIs. Can be set with --rois
+roi_slice = None
+
+# How the stat names of input.csv are matched against stats.txt:
+# 'exact'  : the stat name must be equal to the selected name
+# 'prefix' : the stat name must start with the selected name
+#            (names followed by a space in input.csv are still matched exactly)
+stat_match_mode = 'exact'
+
+# Keep all the parsed stats of each sim in a binary cache (stats.cache.npy/.json)
+# next to stats.txt. stats.txt is parsed again only when it changes.
+use_stats_cache = True
+stats_cache_prefix = 'stats.cache'
+STATS_CACHE_VERSION = 3
+
+# Maximum size in bytes of the parsed values kept in memory (can be set with --memory-budget),
+# or None to parse all the sims at once. With a budget, the sims are parsed in chunks
+# and their values are spilled to spill_dir (see save_plots_out_of_core)
+memory_budget = None
+spill_dir = '.spill'
+
+# Seconds between two polls of the stats.txt files in follow mode (--follow)
+follow_interval = 10
+
+# Number of processes used to parse the sim directories and render the plots
+# Can be set with --jobs. Rendering in parallel needs the pypdf package.
+jobs = 1
 
 linestyles = ['-','--',':','-','--','-.', '-','--','-.','-','--','-.']
 markers = ['.', '^', 'x' ]
@@ -482,6 +1946,14 @@ g_colors = ['blue', 'orange', 'green', 'red', 'purple', 'darkorange', 'darkviole
 
 graph_pdf_fname = 'graphs_out.pdf'
 
+# Keep each rendered plot in plot_cache_dir, keyed by a hash of its
+# stat names, values, labels and style. Only plots whose key changed are
+# drawn again. Needs the pypdf package.
+use_plot_cache = True
+plot_cache_dir = '.plot_cache'
+# Increase when render_page changes, to invalidate the cached plots
+PLOT_STYLE_VERSION = 3
+
 Create_pdf = True
 
 Debug = True
@@ -492,24 +1964,88 @@ mypath = os.getcwd()
 
 df_cols = ['sim_cnt', 'roi_cnt', 'stat_name', 'stat_value']
 
-for filter_str in filter_str_list:
-    simdirs = get_dirs_current_path(mypath, filter_str)
-
-number_of_sims = len(simdirs)
-
-printd('INFO: Number of sims: %d' % number_of_sims);
-
-selected_attrs = get_attr_from_csv('./input/input.csv')
+def main(argv=None):
+    global jobs, roi_slice, follow_interval, Create_pdf, plot_mode, baseline_sim, memory_budget
+
+    parser = argparse.ArgumentParser(description='gem5 stats parser and visualizer')
+    parser.add_argument('-j', '--jobs', type=int, default=jobs,
+                        help='number of processes used to parse the sim directories and render the plots (default: %(default)s)')
+    parser.add_argument('--rois', type=parse_roi_slice, default=roi_slice, metavar='START:STOP',
+                        help='slice of the ROIs to parse, applied after ignore_last_roi, e.g. --rois=-3: for the last 3 ROIs '
+                             '(negative starts need the = form)')
+    parser.add_argument('--follow', action='store_true',
+                        help='follow the stats.txt of running sims, parsing only the ROIs appended since the '
+                             'previous poll, and write the plots again when new ROIs are found (Ctrl-C to stop)')
+    parser.add_argument('--follow-interval', type=float, default=follow_interval, metavar='SECONDS',
+                        help='seconds between two polls in follow mode (default: %(default)s)')
+    parser.add_argument('--plot-mode', choices=['auto'] + PLOT_MODES, default=plot_mode,
+                        help='bars, or heatmap / box plots to compare many sims '
+                             '(default: %(default)s, bars up to max_bar_sims sims)')
+    parser.add_argument('--baseline', metavar='SIM', default=baseline_sim,
+                        help='divide the values of each sim by the values of this sim')
+    parser.add_argument('--memory-budget', type=float, metavar='MB',
+                        help='parse the sims in chunks whose values fit in MB megabytes, spilling them to disk, '
+                             'so that the memory used does not grow with the number of sims')
+    parser.add_argument('--no-pdf', action='store_true',
+                        help='only parse the stats, without drawing the plots (matplotlib is not imported)')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='write the time, bytes read and peak memory of each stage in FILE (.json or .csv)')
+    parser.add_argument('--cprofile', metavar='FILE',
+                        help='write a cProfile dump of the main process in FILE (see python -m pstats)')
+    args = parser.parse_args(argv)
+    jobs = args.jobs
+    roi_slice = args.rois
+    follow_interval = args.follow_interval
+    plot_mode = args.plot_mode
+    baseline_sim = args.baseline
+    if args.memory_budget is not None:
+        memory_budget = int(args.memory_budget * (1 << 20))
+    if args.no_pdf:
+        Create_pdf = False
+    instrument.enabled = args.profile is not None
+
+    if args.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    simdirs = get_simdirs(mypath)
+
+    number_of_sims = len(simdirs)
+
+    printd('INFO: Number of sims: %d' % number_of_sims)
+
+    with instrument.stage('read_input'):
+        selected_attrs = get_attr_from_csv('./input/input.csv')
+
+    for idx, element in enumerate(selected_attrs):
+        #print('Stat # %d' % idx)
+        element.print(idx)
+
+    if args.follow:
+        follow_stats_in_tensor(simdirs, selected_attrs)
+    elif memory_budget is not None:
+        save_plots_out_of_core(simdirs, selected_attrs)
+    else:
+        with instrument.stage('ingest', sims=number_of_sims):
+            stats = parse_stats(simdirs, selected_attrs)
 
-for idx, element in enumerate(selected_attrs):
-    #print('Stat # %d' % idx)
-    element.print(idx)
+        # Stat name patterns of input.csv are resolved against the parsed stat names
+        with instrument.stage('expand_patterns'):
+            selected_attrs = expand_stat_patterns(selected_attrs, StatCatalog(stats.stat_names))
 
-# Could skip this step if already generated
-# This needs to be called everytime we adjust the input.csv file
-generate_short_ROIs(simdirs, selected_attrs)
+        with instrument.stage('plot'):
+            get_plot_data(selected_attrs, stats)
 
-df = add_stats_in_dataframe(simdirs, selected_attrs)
+    if args.cprofile:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile)
+        print('INFO: cProfile dump written to %s' % args.cprofile)
 
-get_plot_data(selected_attrs, df)
+    if args.profile:
+        instrument.print_summary()
+        instrument.write_report(args.profile)
+        print('INFO: Profile written to %s' % args.profile)
 
+if __name__ == '__main__':
+    main()
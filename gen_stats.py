@@ -0,0 +1,172 @@
+#   This file is part of gem5-stats-parser-visualizer
+#
+#   gem5-stats-parser-visualizer is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3.
+#
+#   gem5-stats-parser-visualizer is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with gem5-stats-parser-visualizer. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import sys
+import argparse
+import numpy as np
+
+# Synthetic gem5 stats generator
+#
+# Writes sim_NNNN/stats.txt trees in the format of the sample sims, with
+# more sims, ROIs and stats than the samples, e.g. to run benchmark.py:
+#
+#   python gen_stats.py --sims 16 --rois 50 --stats 20000 --vector-width 8 -o /tmp/bench_tree
+#
+# The stats of the first ROI of a template stats.txt (sim_0001/stats.txt by default)
+# are written in every ROI of every sim, with randomized values:
+# - --stats N adds copies of the system.* template stats (renamed to system.nodeK.*)
+#   until each ROI has N stats
+# - --vector-width W writes the Ruby vector stats (columns separated by '|') with W columns
+
+begin_line = '---------- Begin Simulation Statistics ----------\n'
+end_line = '---------- End Simulation Statistics   ----------\n'
+
+number = re.compile(r'^-?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?%?$')
+
+# One stat line of the template
+# The values are kept as a float array, and the line is written again
+# with a format string, so that every ROI has the same layout.
+class TemplateStat:
+    def __init__(self, ln):
+        body, _, desc = ln.rstrip('\n').partition('#')
+        self.desc = ('# ' + desc.strip()) if desc else ''
+        self.is_vector = '|' in body
+        self.has_percent = '%' in body
+        # The '|' separators can be glued to the values, e.g. |3624353144500 (see parse_stat)
+        tokens = body.replace('|', ' ').split()
+        self.name = tokens[0]
+        self.units = ' '.join(t for t in tokens[1:] if '(' in t)
+
+        # Value tokens (not units, not percents)
+        values = [t for t in tokens[1:] if '(' not in t and not t.endswith('%')]
+        self.is_int = [number.match(t) is not None and '.' not in t and 'e' not in t.lower()
+                       for t in values]
+        self.values = np.array([float(t) if number.match(t) else np.nan for t in values])
+        self.percents = [t for t in tokens[1:] if t.endswith('%')]
+
+    # Returns a copy of the stat, with a new name
+    def renamed(self, name):
+        ret = TemplateStat.__new__(TemplateStat)
+        ret.__dict__.update(self.__dict__)
+        ret.name = name
+        return ret
+
+    # Returns the stat with width columns, if it is a Ruby vector
+    def with_width(self, width):
+        if not self.is_vector or width == len(self.values) or len(self.values) == 0:
+            return self
+        ret = self.renamed(self.name)
+        reps = -(-width // len(self.values))
+        ret.values = np.tile(self.values, reps)[:width]
+        ret.is_int = (self.is_int * reps)[:width]
+        return ret
+
+    def format_value(self, k, x):
+        if np.isnan(x):
+            return 'nan'
+        if self.is_int[k]:
+            return '%d' % round(x)
+        return '%f' % x
+
+    # Returns the stat line, with the values multiplied by scale
+    def line(self, scale):
+        vals = self.values * scale
+        if self.is_vector:
+            if self.has_percent:
+                total = np.nansum(vals)
+                pct = vals / total * 100 if total else np.zeros(len(vals))
+                cum = np.cumsum(pct)
+                cols = ['%12s %9.2f%% %9.2f%%' % (self.format_value(k, x), pct[k], cum[k])
+                        for k, x in enumerate(vals)]
+            else:
+                cols = ['%-33s' % self.format_value(k, x) for k, x in enumerate(vals)]
+            return '%s | %s %s\n' % (self.name, ' | '.join(cols), self.units)
+
+        text = ' '.join('%12s' % self.format_value(k, x) for k, x in enumerate(vals))
+        if self.has_percent:
+            # Distribution bucket: percent and cumulative percent are kept from the template
+            text += ' ' + ' '.join('%9s' % t for t in self.percents)
+        return '%-50s %s %s %s\n' % (self.name, text, self.units, self.desc)
+
+# Returns the TemplateStat instances of the first ROI of a stats.txt
+def read_template(fname):
+    stats = []
+    with open(fname) as f:
+        for ln in f:
+            if ln.startswith('-'):
+                if stats:
+                    break
+                continue
+            if ln.strip() == '':
+                continue
+            stats.append(TemplateStat(ln))
+    return stats
+
+# Adds renamed copies of the system.* stats, until there are nstats stats
+def add_stat_copies(stats, nstats):
+    system_stats = [st for st in stats if st.name.startswith('system.')]
+    ret = list(stats)
+    node = 1
+    while len(ret) < nstats and system_stats:
+        for st in system_stats:
+            if len(ret) >= nstats:
+                break
+            ret.append(st.renamed('system.node%d.%s' % (node, st.name[len('system.'):])))
+        node += 1
+    return ret
+
+# Writes sim_NNNN/stats.txt of one sim
+# Every stat gets a random scale per sim and a smaller random change per ROI
+def write_sim(out_dir, sim_cnt, stats, nrois, rng):
+    sim_dir = os.path.join(out_dir, 'sim_%04d' % (sim_cnt + 1))
+    os.makedirs(sim_dir, exist_ok=True)
+    sim_scale = rng.uniform(0.8, 1.2, len(stats))
+    with open(os.path.join(sim_dir, 'stats.txt'), 'w') as f:
+        for roi_cnt in range(nrois):
+            scales = sim_scale * rng.uniform(0.95, 1.05, len(stats))
+            f.write(begin_line)
+            f.writelines(st.line(scale) for st, scale in zip(stats, scales))
+            f.write(end_line)
+    return sim_dir
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic gem5 stats.txt trees')
+    parser.add_argument('-o', '--output', required=True,
+                        help='directory where the sim_NNNN directories are written')
+    parser.add_argument('--template', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                           'sim_0001', 'stats.txt'),
+                        help='stats.txt used as template (default: %(default)s)')
+    parser.add_argument('--sims', type=int, default=4, help='number of sims (default: %(default)s)')
+    parser.add_argument('--rois', type=int, default=10, help='number of ROIs per sim (default: %(default)s)')
+    parser.add_argument('--stats', type=int, default=0,
+                        help='number of stats per ROI (default: the number of template stats)')
+    parser.add_argument('--vector-width', type=int, default=0,
+                        help='number of columns of Ruby vector stats (default: as in the template)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed (default: %(default)s)')
+    args = parser.parse_args()
+
+    stats = read_template(args.template)
+    if not stats:
+        print('ERROR: No stats found in %s' % args.template)
+        sys.exit()
+    stats = add_stat_copies(stats, args.stats)
+    if args.vector_width > 0:
+        stats = [st.with_width(args.vector_width) for st in stats]
+
+    rng = np.random.default_rng(args.seed)
+    for sim_cnt in range(args.sims):
+        sim_dir = write_sim(args.output, sim_cnt, stats, args.rois, rng)
+        print('%s: %d ROIs x %d stats' % (sim_dir, args.rois, len(stats)))
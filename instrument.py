@@ -0,0 +1,153 @@
+#   This file is part of gem5-stats-parser-visualizer
+#
+#   gem5-stats-parser-visualizer is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3.
+#
+#   gem5-stats-parser-visualizer is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with gem5-stats-parser-visualizer. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import csv
+import json
+import time
+from contextlib import contextmanager
+
+# Stage timing and memory instrumentation (--profile of gem5_parser.py and split.py)
+#
+# Each stage (e.g. parsing the stats.txt of one sim directory, or rendering one plot)
+# adds one record with:
+# - stage: the stage name
+# - dir / page: the sim directory or the plot title, if any
+# - seconds: wall time of the stage
+# - peak_rss_bytes: peak RSS of the process at the end of the stage
+# - counters added while the stage runs (see add), e.g. bytes_read, lines,
+#   stats_kept, stats_missing, and the time of sub-steps (e.g. parse_seconds)
+#
+# When instrumentation is disabled, stage() and add() do nothing.
+
+enabled = False
+
+# Finished stage records
+records = []
+
+# Records of the running stages, innermost last
+active = []
+
+# Peak RSS of the process in bytes, or None if it is not available
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+# Context manager that records a stage, e.g:
+#   with instrument.stage('stream', dir=dir):
+#       ...
+@contextmanager
+def stage(name, **fields):
+    if not enabled:
+        yield None
+        return
+
+    rec = {'stage': name, 'pid': os.getpid()}
+    rec.update(fields)
+    active.append(rec)
+    start = time.perf_counter()
+    try:
+        yield rec
+    finally:
+        rec['seconds'] = time.perf_counter() - start
+        rec['peak_rss_bytes'] = peak_rss_bytes()
+        active.pop()
+        records.append(rec)
+
+# Adds counts to the counters of the innermost running stage
+def add(**counts):
+    if enabled and active:
+        rec = active[-1]
+        for key, value in counts.items():
+            rec[key] = rec.get(key, 0) + value
+
+# Context manager that adds its wall time to the counter key of the
+# innermost running stage, e.g. parse_seconds
+@contextmanager
+def timer(key):
+    if not enabled:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(**{key: time.perf_counter() - start})
+
+# Runs func(*args) with instrumentation enabled, returns (func result, records)
+# Used for functions that run in worker processes, whose records are
+# otherwise lost (see merge)
+def collect(func, *args):
+    global enabled
+    enabled = True
+    del records[:]
+    ret = func(*args)
+    return ret, list(records)
+
+# Adds the records of the (func result, records) tuples returned by collect
+# Returns the list of func results
+def merge(results):
+    ret = []
+    for res, recs in results:
+        records.extend(recs)
+        ret.append(res)
+    return ret
+
+# Totals of each stage: number of records and sum of seconds and counters
+# (peak_rss_bytes is the maximum)
+def summary():
+    ret = {}
+    for rec in records:
+        total = ret.setdefault(rec['stage'], {'count': 0})
+        total['count'] += 1
+        for key, value in rec.items():
+            if key in ('stage', 'pid') or not isinstance(value, (int, float)):
+                continue
+            if key == 'peak_rss_bytes':
+                total[key] = max(total.get(key, 0), value)
+            else:
+                total[key] = total.get(key, 0) + value
+    return ret
+
+def print_summary():
+    print('%-16s %6s %10s %12s %12s %10s' % ('stage', 'count', 'seconds', 'bytes_read', 'lines', 'rss_MB'))
+    for name, total in summary().items():
+        rss = total.get('peak_rss_bytes')
+        print('%-16s %6d %10.3f %12d %12d %10s' % (name, total['count'], total.get('seconds', 0),
+              total.get('bytes_read', 0), total.get('lines', 0),
+              '%.1f' % (rss / 1e6) if rss else '-'))
+
+# Writes the records in a .csv file (one row per record),
+# or in a .json file (records and summary)
+def write_report(fname):
+    if fname.endswith('.csv'):
+        keys = []
+        for rec in records:
+            for key in rec:
+                if key not in keys:
+                    keys.append(key)
+        with open(fname, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=keys)
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        with open(fname, 'w') as f:
+            json.dump({'records': records, 'summary': summary()}, f, indent=2)
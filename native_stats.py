@@ -0,0 +1,175 @@
+#   This file is part of gem5-stats-parser-visualizer
+#
+#   gem5-stats-parser-visualizer is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3.
+#
+#   gem5-stats-parser-visualizer is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with gem5-stats-parser-visualizer. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import numpy as np
+
+# Readers of the HDF5 and JSON stats files of gem5
+#
+# The values are read directly as floats, without the text tokenization of stats.txt.
+# Stats are named as in stats.txt:
+# - scalar stats: system.cpu0.ipc
+# - vector stats: system.ruby.network.router_flits_received, with one column per element
+#   (as the single line vectors of stats.txt), and also one stat per element,
+#   named with its subname (or its index): system.mem_ctrls0.dram.numReads::total
+# stats.txt writes percent and cumulative percent columns for some vectors,
+# the native formats only have the values.
+#
+# stats.h5 (--stats-file=h5://stats.h5): one dataset per stat, in groups that follow
+# the SimObject hierarchy, with one row per stats dump (ROI). Vector datasets have
+# one column per element, and their element names in the 'subnames' attribute.
+# Only the rows of the selected ROIs of the selected stats are read.
+#
+# stats.json: the JSON of the gem5 Python stats (pystats), i.e. nested groups of
+# {"type": "Scalar", "value": ...}, {"type": "Vector", "value": {subname: scalar}}
+# and distributions. The file holds one dump, or a list of dumps (one per ROI),
+# or one dump per line.
+
+native_stats_fnames = ['stats.h5', 'stats.json']
+
+# Keys of a JSON stat that are not values
+json_meta_keys = {'type', 'unit', 'description', 'datatype', 'name'}
+
+# Returns the path of the native stats file of a directory, or None
+def find_native_stats_file(directory):
+    for fname in native_stats_fnames:
+        path = os.path.join(directory, fname)
+        if os.path.isfile(path):
+            return path
+    return None
+
+def is_native(input_file):
+    return input_file.endswith('.h5') or input_file.endswith('.json')
+
+# Names of the stats of a vector with nvalues elements: the vector itself
+# (column None, all the elements) and each element (column k)
+def vector_names(name, subnames, nvalues):
+    if not subnames:
+        subnames = [str(k) for k in range(nvalues)]
+    return [(name, None)] + [('%s::%s' % (name, sub), k) for k, sub in enumerate(subnames)]
+
+# Reads the given ROIs of a HDF5 dataset, as a [roi, column] float array
+def read_h5_rows(dataset, roi_numbers):
+    if not roi_numbers:
+        return np.zeros((0, int(np.prod(dataset.shape[1:], dtype=int))))
+    # Contiguous ROIs are read with a single slice
+    if roi_numbers[-1] - roi_numbers[0] == len(roi_numbers) - 1:
+        rows = dataset[roi_numbers[0]:roi_numbers[-1] + 1]
+    else:
+        rows = dataset[roi_numbers]
+    return np.asarray(rows, dtype=np.float64).reshape(len(roi_numbers), -1)
+
+def read_h5_stats(input_file, match, select_rois):
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError('The h5py package is needed to read %s' % input_file)
+
+    rows = []
+    with h5py.File(input_file, 'r') as f:
+        datasets = []
+        f.visititems(lambda path, obj: datasets.append((path, obj)) if isinstance(obj, h5py.Dataset) else None)
+        roi_cnt = max((dataset.shape[0] for _, dataset in datasets if dataset.ndim), default=0)
+        roi_numbers = select_rois(list(range(roi_cnt)))
+
+        for path, dataset in datasets:
+            if dataset.ndim == 0 or dataset.shape[0] < roi_cnt:
+                continue
+            name = path.replace('/', '.')
+            if dataset.ndim == 1:
+                names = [(name, None)]
+            else:
+                subnames = [s.decode() if isinstance(s, bytes) else str(s)
+                            for s in dataset.attrs.get('subnames', [])]
+                names = vector_names(name, subnames, int(np.prod(dataset.shape[1:])))
+            names = [(stat_name, col) for stat_name, col in names if match(stat_name)]
+            if not names:
+                continue
+
+            values = read_h5_rows(dataset, roi_numbers)
+            for stat_name, col in names:
+                rows.append((stat_name, values if col is None else values[:, col:col + 1]))
+
+    return roi_cnt, rows
+
+# Adds the stats of a JSON group (or stat) to dump_stats: {name: list of values}
+def add_json_stats(node, prefix, dump_stats):
+    value = node.get('value')
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        dump_stats[prefix] = [value]
+    elif isinstance(value, dict):
+        subnames = list(value)
+        values = [sub.get('value') if isinstance(sub, dict) else sub for sub in value.values()]
+        for name, col in vector_names(prefix, [str(sub) for sub in subnames], len(values)):
+            dump_stats[name] = values if col is None else [values[col]]
+    elif isinstance(value, list):
+        for name, col in vector_names(prefix, None, len(value)):
+            dump_stats[name] = value if col is None else [value[col]]
+
+    for key, child in node.items():
+        if key in json_meta_keys or key == 'value':
+            continue
+        name = '%s.%s' % (prefix, key) if prefix else key
+        if isinstance(child, dict):
+            add_json_stats(child, name, dump_stats)
+        # Other numbers of a stat, e.g. the min / max / sum of a distribution
+        elif 'value' in node and isinstance(child, (int, float)) and not isinstance(child, bool):
+            dump_stats['%s::%s' % (prefix, key)] = [child]
+
+# Returns the dumps of a JSON stats file
+def read_json_dumps(input_file):
+    with open(input_file) as f:
+        text = f.read()
+    try:
+        dumps = json.loads(text)
+    except json.JSONDecodeError:
+        # One dump per line
+        dumps = [json.loads(ln) for ln in text.splitlines() if ln.strip()]
+    return dumps if isinstance(dumps, list) else [dumps]
+
+def read_json_stats(input_file, match, select_rois):
+    dumps = read_json_dumps(input_file)
+    roi_cnt = len(dumps)
+    roi_numbers = select_rois(list(range(roi_cnt)))
+
+    values = {}
+    for roi, k in enumerate(roi_numbers):
+        dump_stats = {}
+        add_json_stats(dumps[k], '', dump_stats)
+        for name, vals in dump_stats.items():
+            if name not in values and not match(name):
+                continue
+            # Stats missing in a dump are masked
+            stat_values = values.setdefault(name, [[] for _ in roi_numbers])
+            stat_values[roi] = vals
+
+    rows = []
+    for name, stat_values in values.items():
+        ncol = max(len(vals) for vals in stat_values)
+        arr = np.full((len(roi_numbers), ncol), np.nan)
+        for roi, vals in enumerate(stat_values):
+            arr[roi, :len(vals)] = [np.nan if x is None else x for x in vals]
+        rows.append((name, arr))
+
+    return roi_cnt, rows
+
+# Reads the stats of a stats.h5 or stats.json file
+# match(name) selects the stats, select_rois(list of ROI numbers) the ROIs
+# Returns the number of ROIs of the file, and a list of (stat name, [roi, column] values)
+# of the selected stats and ROIs
+def read_native_stats(input_file, match, select_rois):
+    if input_file.endswith('.h5'):
+        return read_h5_stats(input_file, match, select_rois)
+    return read_json_stats(input_file, match, select_rois)
@@ -15,6 +15,18 @@
 import os
 import re
 import glob
+import io
+import bz2
+import gzip
+import codecs
+import queue
+import threading
+import json
+import mmap
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import instrument
 
 # Regular expression pattern to match delimiter lines
 pattern2 = re.compile(r'^-')
@@ -28,47 +40,328 @@ def write_file(lines, index, prefix, directory):
         return filename
     return None
 
-# Function to process each stats.txt file in the given directory
-def process_directory(directory):
-    input_file = os.path.join(directory, 'stats.txt')
-    prefix = 'stats.roi.'
+# Compressed stats files
+#
+# Finished gem5 runs are often compressed. Besides stats.txt, stats.txt.gz,
+# stats.txt.bz2 and stats.txt.zst are also found and decompressed as a stream,
+# without writing anything to disk (.zst needs the zstandard package).
+# A reader thread decompresses up to readahead_chunks chunks ahead of the
+# parser, so decompression overlaps with parsing. Set readahead_chunks to 0
+# to decompress in the parsing thread.
 
-    # Check if stats.txt exists in the directory
-    if not os.path.isfile(input_file):
-        print(f"No stats.txt found in {directory}")
-        return
+stats_fnames = ['stats.txt', 'stats.txt.gz', 'stats.txt.bz2', 'stats.txt.zst']
+
+readahead_chunks = 4
+readahead_chunk_size = 1 << 22
+
+# Settings of this module, copied to the worker processes (see the initializer
+# of the pools): workers started with spawn or forkserver import split.py again
+def get_config():
+    return {'readahead_chunks': readahead_chunks, 'readahead_chunk_size': readahead_chunk_size}
+
+def set_config(config):
+    globals().update(config)
+
+# Returns the path of the stats file of a directory, or None
+def find_stats_file(directory):
+    for fname in stats_fnames:
+        path = os.path.join(directory, fname)
+        if os.path.isfile(path):
+            return path
+    return None
+
+def is_compressed(input_file):
+    return not input_file.endswith('.txt')
+
+# Opens a compressed stats file as a binary stream of decompressed bytes
+def open_compressed(input_file):
+    if input_file.endswith('.gz'):
+        return gzip.open(input_file, 'rb')
+    if input_file.endswith('.bz2'):
+        return bz2.open(input_file, 'rb')
+    if input_file.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(f"The zstandard package is needed to read {input_file}")
+        return zstandard.ZstdDecompressor().stream_reader(open(input_file, 'rb'), closefd=True)
+    raise ValueError(f"Unknown compression format: {input_file}")
+
+# Generator of the text lines of a binary stream
+# The stream is read (and decompressed) by a separate thread, up to
+# readahead_chunks chunks ahead of the consumer
+def iter_readahead_lines(binary_file):
+    chunks = queue.Queue(maxsize=readahead_chunks)
+    stop = threading.Event()
 
-    # Read the content of the input file
-    with open(input_file, 'r') as file:
-        lines = file.readlines()
+    def reader():
+        try:
+            while not stop.is_set():
+                chunk = binary_file.read(readahead_chunk_size)
+                chunks.put(chunk)
+                if not chunk:
+                    break
+        except Exception as e:
+            chunks.put(e)
 
-    # Initialize variables
-    file_index = 0
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder('utf-8')(), translate=True)
+    rest = ''
+    try:
+        while True:
+            chunk = chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            lines = (rest + decoder.decode(chunk, final=not chunk)).split('\n')
+            rest = lines.pop()
+            for line in lines:
+                yield line + '\n'
+            if not chunk:
+                break
+        if rest:
+            yield rest
+    finally:
+        # Let the reader thread finish, if the consumer stopped early
+        stop.set()
+        while thread.is_alive():
+            try:
+                chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
+
+# Generator of the text lines of a stats file, plain or compressed
+def iter_lines(input_file):
+    if not is_compressed(input_file):
+        with open(input_file, 'r') as file:
+            yield from file
+    elif readahead_chunks > 0:
+        with open_compressed(input_file) as file:
+            yield from iter_readahead_lines(file)
+    else:
+        with open_compressed(input_file) as file:
+            yield from io.TextIOWrapper(file)
+
+# Generator that reads a stats file once, line by line, and yields
+# the lines of each ROI (the lines between two delimiter lines).
+# Only one ROI is kept in memory at a time.
+def iter_rois(input_file):
     current_file_lines = []
+    instrument.add(bytes_read=os.path.getsize(input_file))
 
-    # Process lines and split the file based on the pattern
-    for line in lines:
+    for line in iter_lines(input_file):
         if line.strip() == '':  # Skip empty or whitespace-only lines
             continue
         if pattern2.match(line):
-            if current_file_lines:  # Write the current section only if it has content
-                filename = write_file(current_file_lines, file_index, prefix, directory)
-                if filename:
-                    file_index += 1
+            if current_file_lines:  # Yield the current section only if it has content
+                instrument.add(lines=len(current_file_lines), rois=1)
+                yield current_file_lines
                 current_file_lines = []
         else:
             current_file_lines.append(line)
 
-    # Write the last section if it has content
+    # Yield the last section if it has content
     if current_file_lines:
-        write_file(current_file_lines, file_index, prefix, directory)
+        instrument.add(lines=len(current_file_lines), rois=1)
+        yield current_file_lines
+
+# ROI byte-offset index
+#
+# Instead of writing one file per ROI, the byte offsets of each ROI in stats.txt
+# can be kept in a small sidecar file (stats.txt.idx), built with a single scan.
+# ROI k is then read through a memory map of stats.txt, touching only its own bytes.
+
+index_suffix = '.idx'
+
+# Scans a stats file once and returns a list of [start, end) byte offsets,
+# one per ROI (non empty section between two delimiter lines)
+def build_roi_index(input_file):
+    rois = []
+    start = None
+    has_content = False
+    pos = 0
+    instrument.add(bytes_read=os.path.getsize(input_file))
+
+    with open(input_file, 'rb') as file:
+        for line in file:
+            if line.startswith(b'-'):
+                if has_content:
+                    rois.append([start, pos])
+                start = None
+                has_content = False
+            elif line.strip() != b'':
+                if start is None:
+                    start = pos
+                has_content = True
+            pos += len(line)
+
+    if has_content:
+        rois.append([start, pos])
+
+    return rois
+
+# Writes the ROI index sidecar file of a stats file
+# The index is valid as long as the size and mtime of the stats file do not change
+def write_roi_index(input_file, rois, st):
+    index_file = input_file + index_suffix
+    tmp_file = index_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump({'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'rois': rois}, f)
+    os.replace(tmp_file, index_file)
+
+# Returns the ROI index of a stats file, from its sidecar file if it is still valid
+# Otherwise the index is built and the sidecar file is written
+def load_roi_index(input_file):
+    index_file = input_file + index_suffix
+    st = os.stat(input_file)
+
+    if os.path.isfile(index_file):
+        with open(index_file) as f:
+            index = json.load(f)
+        if index['size'] == st.st_size and index['mtime_ns'] == st.st_mtime_ns:
+            return index['rois']
+
+    rois = build_roi_index(input_file)
+    write_roi_index(input_file, rois, st)
+    return rois
+
+# Generator that yields the lines of the ROIs roi_numbers of a stats file,
+# reading them through a memory map, using the ROI index rois
+def iter_indexed_rois(input_file, rois, roi_numbers):
+    if not roi_numbers:
+        return
+
+    with open(input_file, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for k in roi_numbers:
+                start, end = rois[k]
+                text = io.StringIO(mm[start:end].decode(), newline=None)
+                lines = [line for line in text if line.strip() != '']
+                instrument.add(bytes_read=end - start, lines=len(lines), rois=1)
+                yield lines
+
+# Follows the stats.txt of a running simulation (gem5_parser.py --follow)
+# Each read_rois call reads only the bytes appended since the previous call
+# and returns the lines of the ROIs completed since then.
+# A ROI is complete once the delimiter line that ends it is fully written,
+# so a partially written last ROI (or line) is read again by the next call.
+# Compressed stats files cannot be followed.
+class RoiTail:
+    def __init__(self, input_file):
+        self.input_file = input_file
+        # Byte offset after the last delimiter line read
+        self.offset = 0
+        # (device, inode) of the followed file, to detect a new stats.txt
+        self.file_id = None
+
+    # Returns the lines of each new complete ROI, and True if stats.txt was
+    # replaced or truncated (e.g. a new run), in which case the ROIs are read
+    # again from the start of the file
+    def read_rois(self):
+        st = os.stat(self.input_file)
+        restarted = False
+        if (st.st_dev, st.st_ino) != self.file_id or st.st_size < self.offset:
+            restarted = self.file_id is not None
+            self.file_id = (st.st_dev, st.st_ino)
+            self.offset = 0
+
+        if st.st_size == self.offset:
+            return [], restarted
+
+        with open(self.input_file, 'rb') as file:
+            file.seek(self.offset)
+            data = file.read(st.st_size - self.offset)
+        instrument.add(bytes_read=len(data))
+
+        rois = []
+        current_file_lines = []
+        pos = 0
+        for line in io.BytesIO(data):
+            # Partially written last line
+            if not line.endswith(b'\n'):
+                break
+            pos += len(line)
+            if line.startswith(b'-'):
+                if current_file_lines:
+                    instrument.add(lines=len(current_file_lines), rois=1)
+                    rois.append(current_file_lines)
+                    current_file_lines = []
+                self.offset += pos
+                pos = 0
+            elif line.strip():
+                current_file_lines.append(line.decode().replace('\r\n', '\n'))
+
+        return rois, restarted
+
+# Function to process each stats.txt file in the given directory
+def process_directory(directory, index_only=False):
+    with instrument.stage('index' if index_only else 'split', dir=directory):
+        input_file = find_stats_file(directory)
+        prefix = 'stats.roi.'
+
+        # Check if stats.txt exists in the directory
+        if input_file is None:
+            print(f"No stats.txt found in {directory}")
+            return
+
+        if index_only:
+            if is_compressed(input_file):
+                print(f"Cannot index compressed {input_file}")
+                return
+            rois = build_roi_index(input_file)
+            write_roi_index(input_file, rois, os.stat(input_file))
+            print(f"ROI index of {len(rois)} ROIs written for {directory}")
+            return
+
+        # Split the file based on the pattern
+        for file_index, roi_lines in enumerate(iter_rois(input_file)):
+            with instrument.timer('write_seconds'):
+                write_file(roi_lines, file_index, prefix, directory)
+
+        print(f"Splitting completed for {directory}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Split gem5 stats.txt files in ROI files')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes used to split the sim directories (default: %(default)s)')
+    parser.add_argument('--index', action='store_true',
+                        help='only write the ROI byte-offset index (stats.txt%s) instead of ROI files' % index_suffix)
+    parser.add_argument('--profile', metavar='FILE',
+                        help='write the time, bytes read, lines and peak RSS of each sim directory '
+                             'to FILE (.json or .csv)')
+    parser.add_argument('--cprofile', metavar='FILE',
+                        help='write cProfile stats of the main process to FILE')
+    args = parser.parse_args()
+
+    instrument.enabled = args.profile is not None
+    if args.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
 
-    print(f"Splitting completed for {directory}")
+    # Find all directories containing stats.txt
+    directories = sorted(set(os.path.dirname(file)
+                             for fname in stats_fnames for file in glob.glob('*/' + fname)))
 
-# Find all directories containing stats.txt
-directories = [os.path.dirname(file) for file in glob.glob('*/stats.txt')]
+    # Loop through each directory and process stats.txt
+    if args.jobs > 1 and len(directories) > 1:
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(directories)),
+                                 initializer=set_config, initargs=(get_config(),)) as executor:
+            if instrument.enabled:
+                instrument.merge(executor.map(instrument.collect, repeat(process_directory),
+                                              directories, repeat(args.index)))
+            else:
+                list(executor.map(process_directory, directories, [args.index] * len(directories)))
+    else:
+        for directory in directories:
+            process_directory(directory, args.index)
 
-# Loop through each directory and process stats.txt
-for directory in directories:
-    process_directory(directory)
+    if args.cprofile:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile)
 
+    if instrument.enabled:
+        instrument.print_summary()
+        instrument.write_report(args.profile)
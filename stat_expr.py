@@ -0,0 +1,381 @@
+#   This file is part of gem5-stats-parser-visualizer
+#
+#   gem5-stats-parser-visualizer is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3.
+#
+#   gem5-stats-parser-visualizer is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with gem5-stats-parser-visualizer. If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import numpy as np
+
+# Arithmetic expressions over stats, used in the first column of input.csv
+# Some examples:
+#   system.ruby.network.router_flit_queueing_latency / system.ruby.network.router_flits_received
+#   (system.cpu0.l2.cache.m_demand_hits + system.cpu0.l2.cache.m_demand_misses) / simSeconds
+#   sum(system.mem_ctrls[0-7].dram.readBursts) / 1000
+#
+# Grammar:
+#   expr   := term (('+' | '-') term)*
+#   term   := factor (('*' | '/') factor)*
+#   factor := NUMBER | STAT | '-' factor | '(' expr ')' | FUNC '(' expr (',' expr)* ')'
+# FUNC is one of: sum, mean, min, max
+#
+# Inside a function call, a stat name can contain a range, e.g. system.mem_ctrls[0-7].dram.readBursts,
+# which is expanded to one argument per stat.
+# A stat name can also be a pattern (see is_pattern), e.g. sum(system.cpu*.l2.cache.m_demand_hits),
+# which is expanded to one argument per matching stat, once the parsed stat names are known
+# (see resolve_patterns).
+# Use spaces around the '-' operator, since '-' can also be part of a stat name (e.g. ::0-9 buckets).
+# '*' and '?' are wildcards only after a '.' of the stat name, and when they are followed by
+# a letter, '_', '.', ':' or the end of the name (see wildcard_name_end), e.g.
+# system.cpu*.ipc or system.l2.cache.m_demand_*. Otherwise '*' is a multiplication,
+# e.g. simInsts*2 or system.cpu.ipc*2.
+#
+# An expression is parsed once into a tree of nodes. Evaluation works on whole
+# [sim, roi, column] arrays of all the sims and ROIs at once.
+# Divisions by zero are masked (nan) per element.
+
+FUNCS = ['sum', 'mean', 'min', 'max']
+
+TOKEN = re.compile(r'\s*(?:'
+                   r'(?P<num>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)|'
+                   r'(?P<name>[A-Za-z_](?:[\w.*?]|::[\w*?-]+|\[\d+-\d+\]|\[\*\])*)|'
+                   r'(?P<op>[-+*/(),]))')
+
+RANGE = re.compile(r'\[(\d+)-(\d+)\]')
+
+# Wildcards of stat name patterns: '*' (any characters), '?' (one character)
+# and '[*]' (any component ID, e.g. system.cpu[*].ipc)
+WILDCARD = re.compile(r'\[\*\]|\*|\?')
+
+# Characters after a '*' or '?' wildcard, other than the end of the name
+WILDCARD_FOLLOW = re.compile(r'[A-Za-z_.:*?\s,)]')
+
+FUNC_CALL = re.compile(r'\b(?:%s)\s*\(' % '|'.join(FUNCS))
+
+class ExprError(ValueError):
+    pass
+
+# Expands the first range of a stat name, e.g. cpu[0-3].ipc -> cpu0.ipc, ..., cpu3.ipc
+# Names without a range are returned as a single element list
+def expand_range(name):
+    match = RANGE.search(name)
+    if not match:
+        return [name]
+    start = int(match.group(1))
+    end = int(match.group(2))
+    if start >= end:
+        raise ExprError('Invalid range in %s' % name)
+    ret = []
+    for k in range(start, end + 1):
+        ret.extend(expand_range(name[:match.start()] + str(k) + name[match.end():]))
+    return ret
+
+# Returns the first range of an expression which is not inside a function call,
+# as a (before_text, start, end, after_text) tuple, or None
+# Such a range expands an input.csv row to several stats
+def split_outer_range(text):
+    calls = []
+    for match in FUNC_CALL.finditer(text):
+        depth = 0
+        for pos in range(match.end() - 1, len(text)):
+            if text[pos] == '(':
+                depth += 1
+            elif text[pos] == ')':
+                depth -= 1
+                if depth == 0:
+                    break
+        calls.append((match.start(), pos))
+
+    for match in RANGE.finditer(text):
+        if any(start <= match.start() <= end for start, end in calls):
+            continue
+        return (text[:match.start()], int(match.group(1)), int(match.group(2)), text[match.end():])
+    return None
+
+# Returns the end of a stat name token text[start:end]: the position of its first
+# '*' or '?' that is not a wildcard, or end
+# ([*] is always a wildcard)
+def wildcard_name_end(text, start, end):
+    for pos in range(start, end):
+        if text[pos] not in '*?' or text[pos - 1:pos + 2] == '[*]':
+            continue
+        following = text[pos + 1:pos + 2]
+        if '.' not in text[start:pos] or (following and not WILDCARD_FOLLOW.match(following)):
+            return pos
+    return end
+
+# True if a stat name contains wildcards
+def is_pattern(name):
+    return WILDCARD.search(name) is not None
+
+# The part of a stat name pattern before its first wildcard
+# All the stats matching the pattern start with it
+def pattern_prefix(pattern):
+    match = WILDCARD.search(pattern)
+    return pattern if match is None else pattern[:match.start()]
+
+# Compiles a stat name pattern to a regex, that should match the whole stat name
+def pattern_regex(pattern):
+    parts = []
+    pos = 0
+    for match in WILDCARD.finditer(pattern):
+        parts.append(re.escape(pattern[pos:match.start()]))
+        parts.append({'[*]': r'\d+', '*': '.*', '?': '.'}[match.group(0)])
+        pos = match.end()
+    parts.append(re.escape(pattern[pos:]))
+    return re.compile(''.join(parts))
+
+# Column layout of a binary operation between a and b:
+# stats with the same number of columns are combined column by column,
+# otherwise the first column of b is used for all the columns of a
+# (numbers are broadcasted)
+def align_columns(a, b):
+    if np.ndim(a) == 3 and np.ndim(b) == 3 and a.shape[2] != b.shape[2]:
+        b = b[:, :, :1]
+    return a, b
+
+def divide(a, b):
+    a, b = align_columns(a, b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(np.asarray(b) == 0, np.nan, np.divide(a, b))
+
+OPS = {'+': np.add, '-': np.subtract, '*': np.multiply, '/': divide}
+
+PRECEDENCE = {'+': 1, '-': 1, '*': 2, '/': 2}
+
+class Number:
+    def __init__(self, value):
+        self.value = value
+
+    def stat_refs(self):
+        return []
+
+    def evaluate(self, get_values):
+        return self.value
+
+    def __str__(self):
+        return '%g' % self.value
+
+# A stat of the expression
+# exact is set if the stat name is followed by a space in input.csv
+class StatRef:
+    def __init__(self, name, exact=False):
+        self.name = name
+        self.exact = exact
+
+    def stat_refs(self):
+        return [self]
+
+    # get_values(name) returns the [sim, roi, column] values of a stat or None
+    def evaluate(self, get_values):
+        vals = get_values(self.name)
+        if vals is None:
+            raise KeyError(self.name)
+        return vals
+
+    def __str__(self):
+        return self.name
+
+class Neg:
+    def __init__(self, operand):
+        self.operand = operand
+
+    def stat_refs(self):
+        return self.operand.stat_refs()
+
+    def evaluate(self, get_values):
+        return np.negative(self.operand.evaluate(get_values))
+
+    def __str__(self):
+        if isinstance(self.operand, BinOp):
+            return '-(%s)' % self.operand
+        return '-%s' % self.operand
+
+class BinOp:
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def stat_refs(self):
+        return self.left.stat_refs() + self.right.stat_refs()
+
+    def evaluate(self, get_values):
+        if self.op == '/':
+            return divide(self.left.evaluate(get_values), self.right.evaluate(get_values))
+        a, b = align_columns(self.left.evaluate(get_values), self.right.evaluate(get_values))
+        return OPS[self.op](a, b)
+
+    # Parentheses are only added where needed, e.g. (a + b) / c
+    def __str__(self):
+        prec = PRECEDENCE[self.op]
+        left = str(self.left)
+        right = str(self.right)
+        if isinstance(self.left, BinOp) and PRECEDENCE[self.left.op] < prec:
+            left = '(%s)' % left
+        if isinstance(self.right, BinOp) and PRECEDENCE[self.right.op] <= prec:
+            right = '(%s)' % right
+        return '%s %s %s' % (left, self.op, right)
+
+# sum / mean / min / max of several expressions, element by element
+class Func:
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+
+    def stat_refs(self):
+        return [ref for arg in self.args for ref in arg.stat_refs()]
+
+    def evaluate(self, get_values):
+        args = [arg.evaluate(get_values) for arg in self.args]
+        if self.func == 'min':
+            op = np.minimum
+        elif self.func == 'max':
+            op = np.maximum
+        else:
+            op = np.add
+
+        ret = args[0]
+        for arg in args[1:]:
+            ret, arg = align_columns(ret, arg)
+            ret = op(ret, arg)
+
+        if self.func == 'mean':
+            ret = ret / len(args)
+        return ret
+
+    def __str__(self):
+        return '%s(%s)' % (self.func, ', '.join(str(arg) for arg in self.args))
+
+class Parser:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            match = TOKEN.match(text, pos)
+            if not match:
+                raise ExprError('Invalid stat expression: %s (at \'%s\')' % (self.text, text[pos:].strip()))
+            kind = match.lastgroup
+            value = match.group(kind)
+            pos = match.end()
+            if kind == 'name':
+                pos = wildcard_name_end(text, match.start(kind), pos)
+                value = text[match.start(kind):pos]
+            exact = (pos < len(self.text)) and self.text[pos].isspace()
+            self.tokens.append((kind, value, exact))
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None, False)
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def expect(self, value):
+        token = self.next()
+        if token[1] != value:
+            raise ExprError('Invalid stat expression: %s (expected \'%s\')' % (self.text, value))
+
+    def parse(self):
+        node = self.expr()
+        if self.peek()[0] is not None:
+            raise ExprError('Invalid stat expression: %s (unexpected \'%s\')' % (self.text, self.peek()[1]))
+        return node
+
+    def expr(self):
+        node = self.term()
+        while self.peek()[1] in ('+', '-') and self.peek()[0] == 'op':
+            op = self.next()[1]
+            node = BinOp(op, node, self.term())
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.peek()[1] in ('*', '/') and self.peek()[0] == 'op':
+            op = self.next()[1]
+            node = BinOp(op, node, self.factor())
+        return node
+
+    def factor(self):
+        kind, value, exact = self.next()
+        if kind == 'num':
+            return Number(float(value))
+        if kind == 'op' and value == '-':
+            return Neg(self.factor())
+        if kind == 'op' and value == '(':
+            node = self.expr()
+            self.expect(')')
+            return node
+        if kind == 'name':
+            if value in FUNCS and self.peek()[1] == '(':
+                self.next()
+                args = self.args()
+                self.expect(')')
+                return Func(value, args)
+            if RANGE.search(value):
+                raise ExprError('Invalid stat expression: %s (ranges are only allowed as arguments of %s)'
+                                % (self.text, ', '.join(FUNCS)))
+            return StatRef(value, exact)
+        raise ExprError('Invalid stat expression: %s' % self.text)
+
+    # Arguments of a function call, with stat name ranges expanded
+    def args(self):
+        args = []
+        while True:
+            kind, value, exact = self.peek()
+            if kind == 'name' and RANGE.search(value) and self.pos + 1 < len(self.tokens) \
+                    and self.tokens[self.pos + 1][1] in (',', ')'):
+                self.next()
+                args.extend(StatRef(name, exact) for name in expand_range(value))
+            else:
+                args.append(self.expr())
+            if self.peek()[1] != ',':
+                return args
+            self.next()
+
+# Replaces the stat name patterns that are arguments of a function call with
+# the matching stats, resolve(pattern) returns the list of matching stat names.
+# Patterns can only be function arguments (or a whole input.csv stat, which is
+# expanded to several stats by the caller).
+# The given tree is not changed, so it can be resolved again against other stat names.
+# Returns the root node of the new tree
+def resolve_patterns(node, resolve):
+    if isinstance(node, Func):
+        args = []
+        for arg in node.args:
+            if isinstance(arg, StatRef) and is_pattern(arg.name):
+                names = resolve(arg.name)
+                if not names:
+                    raise ExprError('No stats match %s' % arg.name)
+                args.extend(StatRef(name, True) for name in names)
+            else:
+                args.append(resolve_patterns(arg, resolve))
+        return Func(node.func, args)
+    elif isinstance(node, BinOp):
+        return BinOp(node.op, resolve_patterns(node.left, resolve), resolve_patterns(node.right, resolve))
+    elif isinstance(node, Neg):
+        return Neg(resolve_patterns(node.operand, resolve))
+    elif isinstance(node, StatRef) and is_pattern(node.name):
+        raise ExprError('Stat name patterns are only allowed as arguments of %s: %s'
+                        % (', '.join(FUNCS), node.name))
+    return node
+
+# Parses a stat expression of input.csv, returns the root node
+def parse_expr(text):
+    if text.strip() == '':
+        raise ExprError('Empty stat expression')
+    return Parser(text).parse()
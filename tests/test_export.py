@@ -0,0 +1,50 @@
+#   This file is part of gem5-stats-parser-visualizer
+#
+#   gem5-stats-parser-visualizer is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3.
+#
+#   gem5-stats-parser-visualizer is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with gem5-stats-parser-visualizer. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+pytest.importorskip('pyarrow')
+import export
+
+# Tests of the Parquet dataset export and queries
+#   python -m pytest tests
+
+BEGIN = '---------- Begin Simulation Statistics ----------\n'
+END = '---------- End Simulation Statistics   ----------\n'
+
+@pytest.fixture
+def dataset_dir(tmp_path):
+    sim_dir = tmp_path / 'sim0'
+    sim_dir.mkdir()
+    with open(sim_dir / 'stats.txt', 'w') as f:
+        f.write(BEGIN + 'simInsts 100\nsystem.mem_ctrls0.dram.readBursts 4\n' + END)
+        f.write(BEGIN + 'simInsts 200\nsystem.mem_ctrls0.dram.readBursts 6\n' + END)
+    out_dir = str(tmp_path / 'sweep.parquet')
+    export.write_dataset([str(sim_dir)], out_dir)
+    return out_dir
+
+def test_query(dataset_dir):
+    table = export.query_dataset(dataset_dir, ['system.mem_ctrls*.dram.readBursts'], match_mode='glob')
+    assert table.column('value').to_pylist() == [4, 6]
+    assert export.query_dataset(dataset_dir, ['simInsts'], roi_slice=slice(-1, None)).column('value').to_pylist() == [200]
+
+def test_query_nothing_matches(dataset_dir):
+    schema = export.query_dataset(dataset_dir, ['simInsts']).schema
+    for table in [export.query_dataset(dataset_dir, ['system.l2*.misses'], match_mode='glob'),
+                  export.query_dataset(dataset_dir, ['simInsts'], sims=['sim1'])]:
+        assert table.num_rows == 0
+        assert table.schema.equals(schema)
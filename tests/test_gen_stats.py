@@ -0,0 +1,44 @@
+#   This file is part of gem5-stats-parser-visualizer
+#
+#   gem5-stats-parser-visualizer is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3.
+#
+#   gem5-stats-parser-visualizer is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with gem5-stats-parser-visualizer. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gem5_parser as gp
+from gen_stats import TemplateStat
+
+# Tests of the synthetic stats generator
+#   python -m pytest tests
+
+# Returns the values of a stat line, as parsed by gem5_parser.py
+def parsed_values(ln):
+    name, values, stride = gp.parse_stat(ln)
+    return name, gp.values_to_floats(values).tolist(), stride
+
+def test_vector_values_glued_to_separators():
+    ln = ('system.ruby.network.router_flit_network_latency |3624353144500                       '
+          '|  3386699500                       |2691960340500                       '
+          '|3040015909000                       (Unspecified)\n')
+    st = TemplateStat(ln)
+    assert st.is_vector
+    assert st.values.tolist() == [3624353144500, 3386699500, 2691960340500, 3040015909000]
+    assert parsed_values(st.line(1.0)) == parsed_values(ln)
+
+def test_distribution_round_trip():
+    ln = ('system.cpu.fetch.rateDist::0                 75.0    75.00%    75.00% # Number of instructions '
+          'fetched each cycle (Total)\n')
+    st = TemplateStat(ln)
+    assert parsed_values(st.line(1.0)) == parsed_values(ln)
+    assert parsed_values(st.line(2.0))[1][0] == 150.0
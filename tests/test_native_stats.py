@@ -0,0 +1,90 @@
+#   This file is part of gem5-stats-parser-visualizer
+#
+#   gem5-stats-parser-visualizer is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3.
+#
+#   gem5-stats-parser-visualizer is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with gem5-stats-parser-visualizer. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import json
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gem5_parser as gp
+
+# Tests of the stats.h5 and stats.json readers: they give the same SimStats as stats.txt
+#   python -m pytest tests
+
+BEGIN = '---------- Begin Simulation Statistics ----------\n'
+END = '---------- End Simulation Statistics   ----------\n'
+
+# [roi] -> (simInsts, ipc, router_flits_received, numReads)
+ROIS = [(100, 1.5, [10, 20, 30], [4, 6, 10]),
+        (200, 0.75, [11, 21, 31], [5, 7, 12]),
+        (300, 2.0, [12, 22, 32], [6, 8, 14])]
+SUBNAMES = ['0', '1', 'total']
+
+SELECTED = ['simInsts', 'system.cpu0.ipc', 'system.ruby.network.router_flits_received',
+            'system.mem_ctrls0.dram.numReads::total', 'system.l2.overallMisses']
+
+def write_txt(path):
+    with open(os.path.join(path, 'stats.txt'), 'w') as f:
+        for insts, ipc, flits, reads in ROIS:
+            f.write(BEGIN)
+            f.write('simInsts %d # Number of instructions simulated (Count)\n' % insts)
+            f.write('system.cpu0.ipc %f # IPC (Count/Cycle)\n' % ipc)
+            f.write('system.ruby.network.router_flits_received | %s (Unspecified)\n'
+                    % ' | '.join(str(x) for x in flits))
+            for sub, x in zip(SUBNAMES, reads):
+                f.write('system.mem_ctrls0.dram.numReads::%s %d # Reads (Count)\n' % (sub, x))
+            f.write(END)
+
+def write_h5(path):
+    h5py = pytest.importorskip('h5py')
+    with h5py.File(os.path.join(path, 'stats.h5'), 'w') as f:
+        f['simInsts'] = [roi[0] for roi in ROIS]
+        f['system/cpu0/ipc'] = [roi[1] for roi in ROIS]
+        f['system/ruby/network/router_flits_received'] = [roi[2] for roi in ROIS]
+        f['system/mem_ctrls0/dram/numReads'] = [roi[3] for roi in ROIS]
+        f['system/mem_ctrls0/dram/numReads'].attrs['subnames'] = SUBNAMES
+
+def write_json(path):
+    dumps = [{'simInsts': {'type': 'Scalar', 'value': insts},
+              'system': {'cpu0': {'ipc': {'type': 'Scalar', 'value': ipc}},
+                         'ruby': {'network': {'router_flits_received': {'type': 'Vector', 'value': flits}}},
+                         'mem_ctrls0': {'dram': {'numReads': {'type': 'Vector',
+                                                              'value': dict(zip(SUBNAMES, reads))}}}}}
+             for insts, ipc, flits, reads in ROIS]
+    with open(os.path.join(path, 'stats.json'), 'w') as f:
+        json.dump(dumps, f)
+
+def read_sim_stats(path):
+    selector = gp.StatSelector([gp.Stat(name, 'value', '', '') for name in SELECTED])
+    stats, roi_cnt = gp.stream_sim_stats(str(path), selector)
+    assert roi_cnt == len(ROIS)
+    return stats
+
+@pytest.mark.parametrize('write', [write_h5, write_json])
+def test_native_stats_match_text(tmp_path, write):
+    (tmp_path / 'txt').mkdir()
+    (tmp_path / 'native').mkdir()
+    write_txt(str(tmp_path / 'txt'))
+    write(str(tmp_path / 'native'))
+
+    expected = read_sim_stats(tmp_path / 'txt')
+    stats = read_sim_stats(tmp_path / 'native')
+    assert stats.stat_index == expected.stat_index
+    assert list(stats.ncols) == list(expected.ncols)
+    np.testing.assert_array_equal(stats.values, expected.values)
+    # The missing stat is masked in both
+    assert np.isnan(stats.get('system.l2.overallMisses')).all()
+    assert stats.get('system.ruby.network.router_flits_received').tolist() == [[[10, 20, 30], [11, 21, 31]]]
@@ -0,0 +1,365 @@
+#   This file is part of gem5-stats-parser-visualizer
+#
+#   gem5-stats-parser-visualizer is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3.
+#
+#   gem5-stats-parser-visualizer is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with gem5-stats-parser-visualizer. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gem5_parser as gp
+from stat_expr import parse_expr, is_pattern, ExprError
+from split import RoiTail
+
+# Tests of the stat expressions, the stat line parsing, the stats cache, the follow mode,
+# the plot cache and the out-of-core parsing
+#   python -m pytest tests
+
+BEGIN = '---------- Begin Simulation Statistics ----------\n'
+END = '---------- End Simulation Statistics   ----------\n'
+
+# [sim, roi, column] values of a stat
+def stat_values(*columns):
+    return np.array(columns, dtype=np.float64).reshape(1, 1, -1)
+
+def evaluate(text, stats):
+    return parse_expr(text).evaluate(stats.get)
+
+# Stat expressions
+
+def test_expr_precedence():
+    node = parse_expr('(a + b) / c')
+    assert str(node) == '(a + b) / c'
+    assert [ref.name for ref in node.stat_refs()] == ['a', 'b', 'c']
+    stats = {'a': stat_values(1), 'b': stat_values(3), 'c': stat_values(2)}
+    assert evaluate('(a + b) / c', stats).tolist() == [[[2.0]]]
+    assert evaluate('a + b / c', stats).tolist() == [[[2.5]]]
+
+def test_expr_function_range():
+    node = parse_expr('sum(x[0-3])')
+    assert [ref.name for ref in node.stat_refs()] == ['x0', 'x1', 'x2', 'x3']
+    stats = {'x%d' % k: stat_values(k) for k in range(4)}
+    assert evaluate('sum(x[0-3])', stats).tolist() == [[[6.0]]]
+    assert evaluate('mean(x[0-3])', stats).tolist() == [[[1.5]]]
+    assert evaluate('max(x[0-3]) - min(x[0-3])', stats).tolist() == [[[3.0]]]
+
+def test_expr_range_outside_function():
+    with pytest.raises(ExprError):
+        parse_expr('x[0-3] / 2')
+
+def test_expr_division_by_zero_is_masked():
+    stats = {'a': stat_values(1, 2, 3), 'b': stat_values(1, 0, 2)}
+    ret = evaluate('a / b', stats)
+    assert ret[0, 0, 0] == 1.0
+    assert np.isnan(ret[0, 0, 1])
+    assert ret[0, 0, 2] == 1.5
+    assert np.isnan(evaluate('a / 0', stats)).all()
+
+def test_expr_column_alignment():
+    # Same number of columns: column by column
+    stats = {'a': stat_values(2, 4, 6, 8), 'b': stat_values(1, 2, 3, 4), 'c': stat_values(2),
+             'd': stat_values(10, 20)}
+    assert evaluate('a / b', stats).tolist() == [[[2.0, 2.0, 2.0, 2.0]]]
+    # Otherwise the first column of the right operand is used for every column
+    assert evaluate('a / c', stats).tolist() == [[[1.0, 2.0, 3.0, 4.0]]]
+    assert evaluate('a + d', stats).tolist() == [[[12.0, 14.0, 16.0, 18.0]]]
+    assert evaluate('a * 2', stats).tolist() == [[[4.0, 8.0, 12.0, 16.0]]]
+
+def test_expr_missing_stat():
+    with pytest.raises(KeyError):
+        evaluate('a / b', {'a': stat_values(1)})
+
+# Stat lines
+
+SAMPLE_STATS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sim_0001', 'stats.txt')
+
+STAT_LINES = [
+    'simInsts 3624353144 # Number of instructions simulated (Count)\n',
+    'system.cpu.fetch.rateDist::0 75 75.00% 75.00% # Number of instructions fetched each cycle (Count)\n',
+    'system.ruby.m_latencyHistSeqr::bucket_size 64 # Bucket size (Unspecified)\n',
+    'system.ruby.m_latencyHistSeqr | 10 20.00% 20.00% | 40 80.00% 100.00% (Unspecified)\n',
+    'system.ruby.network.router_flits_received |   859243618     40.53%     40.53% |      736362      0.03%     40.56%'
+    ' |   634654641     29.93%     70.49% |   625598970     29.51%    100.00% (Unspecified)\n',
+    'system.ruby.network.router_flit_network_latency |3624353144500   |  3386699500   |2691960340500 (Unspecified)\n',
+]
+
+# parse_stat of the first version of gem5_parser.py, which returned the values without strides
+def baseline_parse_stat(ln):
+    ret = [f for f in ln.split('#')[0].split(' ') if f != '' and f != '|' and '(' not in f]
+    return [ret[0], [s.replace('|', '').replace('%', '') for s in ret[1:]]]
+
+def test_parse_stat_matches_baseline():
+    with open(SAMPLE_STATS) as f:
+        lines = [ln for ln in f if ln.strip() and not ln.startswith('-')]
+    for ln in STAT_LINES + lines:
+        name, values, _ = gp.parse_stat(ln)
+        baseline_name, baseline_values = baseline_parse_stat(ln)
+        assert name == baseline_name
+        np.testing.assert_array_equal(gp.values_to_floats(values), gp.values_to_floats(baseline_values))
+
+def test_parse_stat_strides():
+    assert [gp.parse_stat(ln)[2] for ln in STAT_LINES] == [1, 3, 1, 3, 3, 1]
+
+def test_get_columns():
+    builder = gp.SimStatsBuilder()
+    builder.add_roi_rows(0, 0, STAT_LINES)
+    stats = builder.build(1, 1)
+
+    name = 'system.ruby.network.router_flits_received'
+    assert stats.get(name).shape == (1, 1, 12)
+    assert stats.get_columns(name)[0, 0].tolist() == [859243618, 736362, 634654641, 625598970]
+    assert stats.get_columns(name, 'percent')[0, 0].tolist() == [40.53, 0.03, 29.93, 29.51]
+    assert stats.get_columns(name, 'cumm_percent')[0, 0].tolist() == [40.53, 40.56, 70.49, 100.0]
+    assert stats.get_columns('system.cpu.fetch.rateDist::0', 'percent').tolist() == [[[75.0]]]
+    assert stats.get_columns('system.ruby.network.router_flit_network_latency')[0, 0].tolist() == \
+        [3624353144500, 3386699500, 2691960340500]
+    with pytest.raises(ValueError):
+        stats.get_columns('simInsts', 'percent')
+
+# Stats cache
+
+def write_stats_file(path, rois):
+    with open(path, 'w') as f:
+        for roi in rois:
+            f.write(BEGIN)
+            f.writelines('%s %s\n' % (name, value) for name, value in roi)
+            f.write(END)
+
+@pytest.fixture
+def sim_dir(tmp_path):
+    write_stats_file(tmp_path / 'stats.txt', [[('simInsts', 100), ('simTicks', 5)],
+                                              [('simInsts', 200), ('simTicks', 7)]])
+    return str(tmp_path)
+
+def test_cache_is_reused(sim_dir):
+    stats_file = os.path.join(sim_dir, 'stats.txt')
+    meta = gp.write_stats_cache(sim_dir, stats_file)
+    assert gp.read_cache_meta(sim_dir, stats_file) == meta
+
+    meta, cached = gp.load_stats_cache(sim_dir)
+    assert meta['stat_names'] == ['simInsts', 'simTicks']
+    assert cached.dense([0, 1], [0, 1], 1)[:, :, 0].tolist() == [[100, 200], [5, 7]]
+
+def test_cache_touched_file(sim_dir):
+    stats_file = os.path.join(sim_dir, 'stats.txt')
+    meta = gp.write_stats_cache(sim_dir, stats_file)
+    st = os.stat(stats_file)
+    os.utime(stats_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+    # Same contents: the cache is still valid, and its mtime is updated
+    touched = gp.read_cache_meta(sim_dir, stats_file)
+    assert touched is not None
+    assert touched['hash'] == meta['hash']
+    assert touched['mtime_ns'] == st.st_mtime_ns + 10 ** 9
+    assert gp.read_cache_meta(sim_dir, stats_file)['mtime_ns'] == touched['mtime_ns']
+
+def test_cache_changed_file(sim_dir):
+    stats_file = os.path.join(sim_dir, 'stats.txt')
+    gp.write_stats_cache(sim_dir, stats_file)
+    st = os.stat(stats_file)
+
+    # Same size, other contents and another mtime: the content hash differs
+    with open(stats_file) as f:
+        text = f.read()
+    with open(stats_file, 'w') as f:
+        f.write(text.replace('simInsts 200', 'simInsts 300'))
+    os.utime(stats_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert gp.read_cache_meta(sim_dir, stats_file) is None
+
+    # Other size
+    with open(stats_file, 'a') as f:
+        f.write(BEGIN + 'simInsts 400\n' + END)
+    assert gp.read_cache_meta(sim_dir, stats_file) is None
+
+    meta, cached = gp.load_stats_cache(sim_dir)
+    assert cached.number_of_rois == 3
+    assert cached.dense([0], [0, 1, 2], 1)[0, :, 0].tolist() == [100, 300, 400]
+
+# Follow mode reader
+
+def append(path, text):
+    with open(path, 'a') as f:
+        f.write(text)
+
+def test_roi_tail_line_cut(tmp_path):
+    path = str(tmp_path / 'stats.txt')
+    tail = RoiTail(path)
+    append(path, BEGIN + 'simInsts 100\nsimTi')
+    assert tail.read_rois() == ([], False)
+
+    append(path, 'cks 5\n' + END + BEGIN + 'simInsts 2')
+    rois, restarted = tail.read_rois()
+    assert rois == [['simInsts 100\n', 'simTicks 5\n']]
+    assert not restarted
+
+    append(path, '00\n' + END)
+    assert tail.read_rois() == ([['simInsts 200\n']], False)
+    assert tail.read_rois() == ([], False)
+
+def test_roi_tail_delimiter_cut(tmp_path):
+    path = str(tmp_path / 'stats.txt')
+    tail = RoiTail(path)
+    append(path, BEGIN + 'simInsts 100\n' + END[:12])
+    assert tail.read_rois() == ([], False)
+
+    append(path, END[12:])
+    assert tail.read_rois() == ([['simInsts 100\n']], False)
+
+def test_roi_tail_restart(tmp_path):
+    path = str(tmp_path / 'stats.txt')
+    tail = RoiTail(path)
+    append(path, BEGIN + 'simInsts 100\n' + END)
+    assert tail.read_rois() == ([['simInsts 100\n']], False)
+
+    # A new, shorter, stats.txt is read from its start
+    with open(path, 'w') as f:
+        f.write(BEGIN + 'a 1\n' + END)
+    assert tail.read_rois() == ([['a 1\n']], True)
+
+def test_expr_multiplication_is_not_a_wildcard():
+    stats = {'simInsts': stat_values(3), 'simTicks': stat_values(5), 'system.cpu.ipc': stat_values(2)}
+    for text, expected in [('simInsts*2', 6.0), ('simInsts*simTicks', 15.0), ('system.cpu.ipc*2', 4.0),
+                           ('system.cpu.ipc * simTicks', 10.0)]:
+        node = parse_expr(text)
+        assert not any(is_pattern(ref.name) for ref in node.stat_refs()), text
+        assert evaluate(text, stats).tolist() == [[[expected]]], text
+
+def test_expr_wildcards():
+    for text, pattern in [('system.cpu*.l2.cache.m_demand_*', 'system.cpu*.l2.cache.m_demand_*'),
+                          ('sum(system.mem_ctrls[*].dram.readBursts)', 'system.mem_ctrls[*].dram.readBursts'),
+                          ('sum(system.cpu?.ipc) * 2', 'system.cpu?.ipc'),
+                          ('system.cpu.fetch.rateDist::*', 'system.cpu.fetch.rateDist::*')]:
+        assert [ref.name for ref in parse_expr(text).stat_refs()] == [pattern]
+        assert is_pattern(pattern)
+
+def test_unmatched_pattern_is_an_error():
+    attrs = [gp.Stat('system.cpu*.ipc', 'value', '', '')]
+    with pytest.raises(SystemExit):
+        gp.expand_stat_patterns(attrs, gp.StatCatalog(['simInsts']))
+
+def test_follow_keeps_last_roi(tmp_path):
+    path = str(tmp_path / 'stats.txt')
+    append(path, BEGIN + 'simInsts 100\n' + END)
+    follower = gp.SimFollower(str(tmp_path), gp.StatSelector([gp.Stat('simInsts', 'value', '', '')]))
+    assert follower.update() == 1
+
+    # The newest complete ROI of a running sim is not its shutdown ROI
+    assert gp.ignore_last_roi
+    stats = follower.get_sim_stats()
+    assert stats.number_of_rois() == 1
+    assert stats.get('simInsts')[:, :, 0].tolist() == [[100]]
+
+    append(path, BEGIN + 'simInsts 200\n' + END)
+    assert follower.update() == 1
+    assert follower.get_sim_stats().get('simInsts')[:, :, 0].tolist() == [[100, 200]]
+
+# Plot cache
+
+def test_plot_page_key_includes_style(monkeypatch):
+    page = gp.PlotPage('system.cpu.ipc', 'ipc', np.ones((2, 3)), ['a', 'b'], kind='heatmap')
+    key = page.key()
+    assert gp.PlotPage('system.cpu.ipc', 'ipc', np.ones((2, 3)), ['a', 'b'], kind='heatmap').key() == key
+    monkeypatch.setattr(gp, 'max_heatmap_labels', gp.max_heatmap_labels + 1)
+    assert page.key() != key
+
+def test_expand_patterns_keeps_selected_attrs():
+    attrs = [gp.Stat('sum(system.cpu*.ipc)', 'value', '', '')]
+    expanded = gp.expand_stat_patterns(attrs, gp.StatCatalog(['system.cpu0.ipc']))
+    assert [ref.name for ref in expanded[0].stat_refs()] == ['system.cpu0.ipc']
+
+    # The pattern is still there, and matches the stats added later
+    assert [ref.name for ref in attrs[0].stat_refs()] == ['system.cpu*.ipc']
+    expanded = gp.expand_stat_patterns(attrs, gp.StatCatalog(['system.cpu0.ipc', 'system.cpu1.ipc']))
+    assert [ref.name for ref in expanded[0].stat_refs()] == ['system.cpu0.ipc', 'system.cpu1.ipc']
+
+def test_unmatched_pattern_is_skipped_in_follow_mode():
+    attrs = [gp.Stat('system.cpu*.ipc', 'value', '', ''), gp.Stat('sum(system.l2*.misses)', 'value', '', ''),
+             gp.Stat('simInsts', 'value', '', '')]
+    expanded = gp.expand_stat_patterns(attrs, gp.StatCatalog(['simInsts']), skip_unmatched=True)
+    assert [attr.name for attr in expanded] == ['simInsts']
+
+def test_follow_pattern_matches_later_stats(tmp_path):
+    path = str(tmp_path / 'stats.txt')
+    append(path, BEGIN + 'system.cpu0.ipc 1\n' + END)
+    attrs = [gp.Stat('sum(system.cpu*.ipc)', 'value', '', '')]
+    follower = gp.SimFollower(str(tmp_path), gp.StatSelector(attrs))
+    follower.update()
+    assert follower.get_sim_stats().stat_names == ['system.cpu0.ipc']
+
+    append(path, BEGIN + 'system.cpu0.ipc 2\nsystem.cpu1.ipc 3\n' + END)
+    follower.update()
+    stats = follower.get_sim_stats()
+    expanded = gp.expand_stat_patterns(attrs, gp.StatCatalog(stats.stat_names), skip_unmatched=True)
+    # system.cpu1.ipc is missing (nan) in the first ROI
+    ret = evaluate(str(expanded[0].expr), stats)[0, :, 0]
+    assert np.isnan(ret[0]) and ret[1] == 5
+
+def test_prune_plot_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(gp, 'plot_cache_dir', str(tmp_path))
+    kept, old = 'a' * 32 + '.pdf', 'b' * 32 + '.pdf'
+    for fname in [kept, old, old + '.tmp', 'notes.pdf', 'c' * 32 + '.txt']:
+        (tmp_path / fname).write_text('')
+    (tmp_path / ('d' * 32 + '.pdf')).mkdir()
+
+    gp.prune_plot_cache([str(tmp_path / kept)])
+    assert sorted(os.listdir(tmp_path)) == [kept, 'c' * 32 + '.txt', 'd' * 32 + '.pdf', 'notes.pdf']
+
+# Out-of-core parsing (memory_budget)
+
+@pytest.fixture
+def sweep_dirs(tmp_path):
+    simdirs = []
+    for k in range(5):
+        sim_dir = tmp_path / ('sim_%04d' % k)
+        sim_dir.mkdir()
+        rois = [[('simInsts', 100 * k + roi), ('simTicks', 10 + roi),
+                 ('system.ruby.network.router_flits_received', '| %d | %d | %d' % (k, roi, k + roi))] +
+                # The stats of the second CPU are only in some sims
+                [('system.cpu%d.ipc' % cpu, 0.5 * (k + cpu + roi)) for cpu in range(1 + k % 2)]
+                for roi in range(3)]
+        write_stats_file(sim_dir / 'stats.txt', rois)
+        simdirs.append(str(sim_dir))
+    return simdirs
+
+def test_spilled_stats_match_in_memory(sweep_dirs, tmp_path, monkeypatch):
+    monkeypatch.setattr(gp, 'Debug', False)
+    monkeypatch.setattr(gp, 'spill_dir', str(tmp_path / 'spill'))
+    attrs = [gp.Stat('simInsts', 'value', '', ''), gp.Stat('simInsts / simTicks', 'value', '', ''),
+             gp.Stat('sum(system.cpu*.ipc)', 'value', '', ''),
+             gp.Stat('system.ruby.network.router_flits_received', 'value', '', '')]
+
+    stats = gp.parse_stats(sweep_dirs, attrs)
+    pages = gp.get_plot_pages(gp.expand_stat_patterns(attrs, gp.StatCatalog(stats.stat_names)), stats)
+
+    # A budget of one byte parses and spills one sim per chunk
+    monkeypatch.setattr(gp, 'memory_budget', 1)
+    os.makedirs(gp.spill_dir)
+    chunks, number_of_rois = gp.spill_sim_chunks(sweep_dirs, attrs)
+    assert len(chunks) == len(sweep_dirs)
+    assert number_of_rois == stats.number_of_rois()
+
+    stat_names, ncols, strides = gp.get_spilled_stats(len(chunks))
+    assert stat_names == stats.stat_names
+    assert list(ncols) == list(stats.ncols)
+    assert list(strides) == list(stats.strides)
+    spilled = np.concatenate([gp.load_spilled_chunk(k, stat_names, ncols, strides).values
+                              for k in range(len(chunks))])
+    np.testing.assert_array_equal(spilled, stats.values)
+
+    spilled_pages = gp.get_spilled_plot_pages(attrs, chunks, number_of_rois)
+    assert isinstance(spilled_pages[0].values, np.memmap)
+    assert [page.title for page in spilled_pages] == [page.title for page in pages]
+    for page, spilled_page in zip(pages, spilled_pages):
+        assert spilled_page.labels == page.labels
+        np.testing.assert_array_equal(spilled_page.values, page.values)
@@ -0,0 +1,124 @@
+#   This file is part of gem5-stats-parser-visualizer
+#
+#   gem5-stats-parser-visualizer is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3.
+#
+#   gem5-stats-parser-visualizer is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with gem5-stats-parser-visualizer. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import gzip
+import bz2
+import threading
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import split
+from split import iter_rois, load_roi_index, iter_indexed_rois, index_suffix
+
+# Tests of the stats.txt readers: ROI index and compressed stats files
+#   python -m pytest tests
+
+BEGIN = '---------- Begin Simulation Statistics ----------\n'
+END = '---------- End Simulation Statistics   ----------\n'
+
+ROIS = [['simInsts %d # Number of instructions simulated (Count)\n' % (100 * k),
+         'system.cpu.fetch.rateDist::0 %d %5.2f%% %5.2f%% # Number of instructions fetched each cycle (Count)\n'
+         % (k, 10.0 * k, 10.0 * k),
+         'system.mem_ctrls.dram.avgLatency %d.5 # Average latency (µs)\n' % k]
+        for k in range(1, 4)]
+
+# Writes the ROIs, with empty lines around the delimiters
+def stats_text(rois):
+    return ''.join(BEGIN + '\n' + ''.join(roi) + '\n' + END + '\n' for roi in rois)
+
+def write_stats(path, rois):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(stats_text(rois))
+
+# ROI index
+
+def test_indexed_rois_match_iter_rois(tmp_path):
+    path = str(tmp_path / 'stats.txt')
+    write_stats(path, ROIS)
+    rois = load_roi_index(path)
+    assert len(rois) == len(ROIS)
+    assert os.path.isfile(path + index_suffix)
+
+    assert list(iter_indexed_rois(path, rois, [0, 1, 2])) == list(iter_rois(path)) == ROIS
+    assert list(iter_indexed_rois(path, rois, [2, 0])) == [ROIS[2], ROIS[0]]
+    assert list(iter_indexed_rois(path, rois, [])) == []
+
+def test_stale_roi_index(tmp_path):
+    path = str(tmp_path / 'stats.txt')
+    write_stats(path, ROIS)
+    rois = load_roi_index(path)
+
+    # A valid index is read from its sidecar file
+    index_mtime = os.stat(path + index_suffix).st_mtime_ns
+    assert load_roi_index(path) == rois
+    assert os.stat(path + index_suffix).st_mtime_ns == index_mtime
+
+    # Same size, other contents and another mtime
+    st = os.stat(path)
+    changed = [[ln.replace('simInsts 200', 'simInsts 900') for ln in roi] for roi in ROIS]
+    write_stats(path, changed)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert os.path.getsize(path) == st.st_size
+    rois = load_roi_index(path)
+    assert list(iter_indexed_rois(path, rois, [1])) == [changed[1]]
+
+    # Other size: the ROIs moved
+    longer = [['simTicks 5\n'] + roi for roi in ROIS] + [ROIS[0]]
+    write_stats(path, longer)
+    rois = load_roi_index(path)
+    assert list(iter_indexed_rois(path, rois, list(range(len(rois))))) == list(iter_rois(path)) == longer
+
+# Compressed stats files
+
+def write_compressed(path, text):
+    data = text.encode('utf-8')
+    if path.endswith('.gz'):
+        with gzip.open(path, 'wb') as f:
+            f.write(data)
+    elif path.endswith('.bz2'):
+        with bz2.open(path, 'wb') as f:
+            f.write(data)
+    else:
+        zstandard = pytest.importorskip('zstandard')
+        with open(path, 'wb') as f:
+            f.write(zstandard.ZstdCompressor().compress(data))
+
+@pytest.mark.parametrize('suffix', ['.gz', '.bz2', '.zst'])
+@pytest.mark.parametrize('readahead_chunks', [0, 4])
+def test_compressed_rois_match_plain(tmp_path, monkeypatch, suffix, readahead_chunks):
+    # Chunks of 5 bytes cut the lines, and the 2 bytes of the µ characters
+    monkeypatch.setattr(split, 'readahead_chunks', readahead_chunks)
+    monkeypatch.setattr(split, 'readahead_chunk_size', 5)
+    path = str(tmp_path / 'stats.txt')
+    write_stats(path, ROIS)
+    write_compressed(path + suffix, stats_text(ROIS))
+
+    assert split.find_stats_file(str(tmp_path)) == path
+    assert list(iter_rois(path + suffix)) == list(iter_rois(path)) == ROIS
+
+def test_readahead_stops_with_consumer(tmp_path, monkeypatch):
+    monkeypatch.setattr(split, 'readahead_chunk_size', 5)
+    write_compressed(str(tmp_path / 'stats.txt.gz'), stats_text(ROIS))
+    path = split.find_stats_file(str(tmp_path))
+    assert path.endswith('stats.txt.gz') and split.is_compressed(path)
+
+    # The reader thread is blocked on the full queue until the consumer stops
+    threads = threading.active_count()
+    rois = iter_rois(path)
+    assert next(rois) == ROIS[0]
+    assert threading.active_count() == threads + 1
+    rois.close()
+    assert threading.active_count() == threads